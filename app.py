@@ -1,9 +1,22 @@
 """Flask web app — Healthcare EDI and API Parser."""
 
+import atexit
+import csv
+import io
+import json
+import multiprocessing
 import os
-import uuid
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Response, render_template, request, send_file
+
+try:
+    from orjson import dumps as _json_dumps
+except ImportError:  # orjson is an optional speedup
+    _json_dumps = json.dumps
 
 from edi_parser import EDIFile
 from format_detect import detect_format, detect_x12_type
@@ -19,9 +32,32 @@ from excel_writer import write_combined_excel
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024  # 50 MB limit
 
-UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+SPOOL_MAX_SIZE = 32 * 1024 * 1024  # Generated workbooks larger than this go to a temp file
+
+# Parsing is CPU-bound and shares nothing between files, so multi-file
+# uploads are parsed in separate processes. One pool serves every request;
+# its workers are started by _warm_pool() or on first use. A pool broken by
+# a dying worker is replaced by _replace_pool().
+POOL_WORKERS = min(8, os.cpu_count() or 2)
+# Workers are started lazily from request threads, and forking a process
+# that has other threads running can copy a lock some thread was holding.
+# Workers are therefore spawned, not forked from the server process. (A fork
+# server would be shared with children forked from this process, such as
+# gunicorn --preload workers, and they can't use it.)
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _new_pool():
+    """A process pool for parsing uploads."""
+    return ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=_POOL_CONTEXT)
+
+
+_POOL = _new_pool()
+_POOL_LOCK = threading.Lock()
+
 
+# Shared sniffer for delimited uploads (it keeps no per-call state)
+_SNIFFER = csv.Sniffer()
 
 FORMAT_LABELS = {
     "x12": "X12/EDI",
@@ -42,82 +78,78 @@ def index():
 def upload():
     files = request.files.getlist("files")
     if not files or all(not f.filename for f in files):
-        return jsonify({"error": "No files provided"}), 400
+        return _json_error("No files provided", 400)
 
     all_835 = []   # (filename, parsed_transactions)
     all_837 = []   # (filename, parsed_transactions)
     other = []     # (filename, format_name, sheets_list)
     errors = []
 
+    # Files are read here in the request thread; with several uploads the
+    # CPU-bound parsing is farmed out to the process pool
+    parallel = sum(1 for f in files if f.filename) > 1
+    # (filename, content, outcome or Future, pool running the Future), in
+    # upload order
+    outcomes = []
+
     for file in files:
         if not file.filename:
             continue
 
+        filename = file.filename
+
         # Read file content
         try:
-            raw = file.read()
-            try:
-                content = raw.decode("utf-8")
-            except UnicodeDecodeError:
-                content = raw.decode("latin-1")
+            content = _read_upload(file)
         except Exception as e:
-            errors.append(f"{file.filename}: Could not read file — {e}")
+            outcomes.append((filename, None,
+                             ("error", f"{filename}: Could not read file — {e}"), None))
             continue
 
-        if not content.strip():
-            errors.append(f"{file.filename}: File is empty")
-            continue
-
-        # Detect format
-        fmt = detect_format(content)
-
-        if fmt is None:
-            errors.append(f"{file.filename}: Could not detect file format")
-            continue
+        pool = None
+        if parallel:
+            pool = _POOL
+            try:
+                outcome = pool.submit(_parse_one, filename, content)
+            except BrokenProcessPool:
+                # The rest of this request is parsed inline
+                _replace_pool(pool)
+                parallel = False
+                pool = None
+                outcome = _parse_one(filename, content)
+        else:
+            outcome = _parse_one(filename, content)
+        outcomes.append((filename, content, outcome, pool))
 
-        try:
-            if fmt == "x12":
-                _handle_x12(file.filename, content, all_835, all_837, other, errors)
-            elif fmt == "hl7v2":
-                sheets = parse_hl7v2(content)
-                if sheets:
-                    other.append((file.filename, "HL7 v2.x", sheets))
-                else:
-                    errors.append(f"{file.filename}: No HL7 v2 messages found")
-            elif fmt == "fhir":
-                sheets = parse_fhir(content)
-                if sheets:
-                    other.append((file.filename, "FHIR", sheets))
-                else:
-                    errors.append(f"{file.filename}: No FHIR resources found")
-            elif fmt == "cda":
-                sheets = parse_cda(content)
-                if sheets:
-                    other.append((file.filename, "CDA", sheets))
-                else:
-                    errors.append(f"{file.filename}: Could not parse CDA document")
-            elif fmt == "ncpdp":
-                sheets = parse_ncpdp(content)
-                if sheets:
-                    other.append((file.filename, "NCPDP", sheets))
-                else:
-                    errors.append(f"{file.filename}: Could not parse NCPDP data")
-            elif fmt == "csv":
-                sheets = _parse_csv(content)
-                if sheets:
-                    other.append((file.filename, "Delimited", sheets))
-                else:
-                    errors.append(f"{file.filename}: Could not parse delimited data")
-            else:
-                errors.append(f"{file.filename}: Unsupported format '{fmt}'")
-        except Exception as e:
-            errors.append(f"{file.filename}: Parse error — {e}")
+    # Collect in upload order so the workbook layout doesn't depend on timing
+    for filename, content, outcome, pool in outcomes:
+        if isinstance(outcome, Future):
+            try:
+                outcome = outcome.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory) and took the pool
+                # with it; files it hadn't finished are parsed here instead
+                _replace_pool(pool)
+                outcome = _parse_one(filename, content)
+            except Exception as e:
+                outcome = ("error", f"{filename}: Parse error — {e}")
+
+        kind, payload = outcome
+        if kind == "835":
+            all_835.append((filename, payload))
+        elif kind == "837":
+            all_837.append((filename, payload))
+        elif kind == "other":
+            format_name, sheets = payload
+            other.append((filename, format_name, sheets))
+        else:
+            errors.append(payload)
 
     if not all_835 and not all_837 and not other:
         msg = "No valid healthcare files found."
         if errors:
             msg += " Errors: " + "; ".join(errors)
-        return jsonify({"error": msg}), 400
+        return _json_error(msg, 400)
 
     # Generate combined Excel
     if len(files) == 1 and files[0].filename:
@@ -126,73 +158,175 @@ def upload():
     else:
         output_filename = "combined_parsed.xlsx"
 
-    output_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}_{output_filename}")
+    # Build the workbook in memory (spilling to disk only for very large
+    # outputs); send_file closes the buffer once the response is sent
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
 
     try:
-        write_combined_excel(all_835, all_837, output_path, other_formats=other)
+        write_combined_excel(all_835, all_837, output, other_formats=other)
     except Exception as e:
-        return jsonify({"error": f"Failed to generate Excel: {e}"}), 500
+        output.close()
+        return _json_error(f"Failed to generate Excel: {e}", 500)
 
-    response = send_file(
-        output_path,
+    output.seek(0)
+    return send_file(
+        output,
         as_attachment=True,
         download_name=output_filename,
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
 
-    @response.call_on_close
-    def cleanup():
-        try:
-            os.remove(output_path)
-        except OSError:
-            pass
 
-    return response
+def _json_error(message, status):
+    """Build a JSON error response without the jsonify/app-context overhead."""
+    return Response(_json_dumps({"error": message}), status=status,
+                    mimetype="application/json")
+
+
+def _read_upload(file):
+    """Read an uploaded file and decode it to text.
+
+    The raw bytes only live inside this helper, so they are released as soon
+    as the decoded text exists rather than staying alive through the parse.
+    """
+    raw = file.read()
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        # Latin-1 maps every byte, so this fallback never fails
+        return raw.decode("latin-1")
+
 
+def _replace_pool(broken):
+    """Swap in a new process pool for a broken one.
 
-def _handle_x12(filename, content, all_835, all_837, other, errors):
+    Requests that saw the same pool break only replace it once.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is broken:
+            _POOL = _new_pool()
+    broken.shutdown(wait=False)
+
+
+@atexit.register
+def _shutdown_pool():
+    _POOL.shutdown(wait=False)
+
+
+def _reset_pool_after_fork():
+    """Give a forked child a pool of its own.
+
+    A started pool's management thread doesn't survive fork(), so a child
+    (e.g. a gunicorn worker forked from a --preload master) would queue work
+    that nothing ever hands to the workers.
+    """
+    global _POOL, _POOL_LOCK
+    _POOL_LOCK = threading.Lock()
+    _POOL = _new_pool()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def _warm_pool():
+    """Start the pool's worker processes ahead of the first upload."""
+    # Each submit spawns a worker while none is idle, so this brings the
+    # pool up to full size
+    for future in [_POOL.submit(os.getpid) for _ in range(POOL_WORKERS)]:
+        future.result()
+
+
+def _parse_one(filename, content):
+    """Detect the format of one uploaded file and parse it.
+
+    Runs in a worker process for multi-file uploads, so it takes and returns
+    only picklable data. Returns one of:
+        ("835", parsed_transactions)
+        ("837", parsed_transactions)
+        ("other", (format_name, sheets_list))
+        ("error", message)
+    """
+    # isspace() stops at the first non-blank character instead of copying
+    if not content or content.isspace():
+        return "error", f"{filename}: File is empty"
+
+    # Detect format
+    fmt = detect_format(content)
+
+    if fmt is None:
+        return "error", f"{filename}: Could not detect file format"
+
+    try:
+        if fmt == "x12":
+            return _handle_x12(filename, content)
+        elif fmt == "hl7v2":
+            sheets = parse_hl7v2(content)
+            if sheets:
+                return "other", ("HL7 v2.x", sheets)
+            return "error", f"{filename}: No HL7 v2 messages found"
+        elif fmt == "fhir":
+            sheets = parse_fhir(content)
+            if sheets:
+                return "other", ("FHIR", sheets)
+            return "error", f"{filename}: No FHIR resources found"
+        elif fmt == "cda":
+            sheets = parse_cda(content)
+            if sheets:
+                return "other", ("CDA", sheets)
+            return "error", f"{filename}: Could not parse CDA document"
+        elif fmt == "ncpdp":
+            sheets = parse_ncpdp(content)
+            if sheets:
+                return "other", ("NCPDP", sheets)
+            return "error", f"{filename}: Could not parse NCPDP data"
+        elif fmt == "csv":
+            sheets = _parse_csv(content)
+            if sheets:
+                return "other", ("Delimited", sheets)
+            return "error", f"{filename}: Could not parse delimited data"
+        else:
+            return "error", f"{filename}: Unsupported format '{fmt}'"
+    except Exception as e:
+        return "error", f"{filename}: Parse error — {e}"
+
+
+def _handle_x12(filename, content):
     """Route X12 files to the appropriate parser."""
     try:
         edi = EDIFile(content)
     except ValueError as e:
-        errors.append(f"{filename}: {e}")
-        return
+        return "error", f"{filename}: {e}"
     except Exception as e:
-        errors.append(f"{filename}: Failed to parse X12 — {e}")
-        return
+        return "error", f"{filename}: Failed to parse X12 — {e}"
 
     txn_type = edi.get_transaction_type()
 
     if txn_type == "835":
-        parsed = parse_835(edi)
-        all_835.append((filename, parsed))
+        return "835", parse_835(edi)
     elif txn_type == "837":
-        parsed = parse_837(edi)
-        all_837.append((filename, parsed))
+        return "837", parse_837(edi)
     elif txn_type:
         # Other X12 types (270, 271, 276, 277, 278, 834, etc.)
         sheets = parse_x12_generic(edi)
         if sheets:
-            other.append((filename, f"X12 {txn_type}", sheets))
-        else:
-            errors.append(f"{filename}: No data found in X12 {txn_type}")
+            return "other", (f"X12 {txn_type}", sheets)
+        return "error", f"{filename}: No data found in X12 {txn_type}"
     else:
-        errors.append(f"{filename}: Could not determine X12 transaction type")
+        return "error", f"{filename}: Could not determine X12 transaction type"
 
 
 def _parse_csv(content):
     """Parse CSV/TSV/delimited content into sheets."""
-    import csv
-    import io
-
     content = content.strip()
     if not content:
         return []
 
     # Detect delimiter
-    sniffer = csv.Sniffer()
+    sample = content[:4000]
     try:
-        dialect = sniffer.sniff(content[:4000])
+        dialect = _SNIFFER.sniff(sample)
     except csv.Error:
         dialect = csv.excel  # Default to comma
 
@@ -204,7 +338,13 @@ def _parse_csv(content):
 
     # Check if first row looks like headers (non-numeric, unique)
     first_row = rows_data[0]
-    has_header = sniffer.has_header(content[:4000]) if len(rows_data) > 1 else True
+    if len(rows_data) == 1:
+        has_header = True
+    else:
+        try:
+            has_header = _SNIFFER.has_header(sample)
+        except csv.Error:
+            has_header = True
 
     if has_header:
         headers = first_row
@@ -224,10 +364,25 @@ def _parse_csv(content):
     return [{"name": "Data", "headers": headers, "rows": padded_rows, "currency_cols": []}]
 
 
+# Warm the pool as soon as the app is imported, so it is ready before the
+# first upload under a WSGI server (gunicorn, uWSGI) or "flask run", with or
+# without the reloader. Pool workers import this module too (as __mp_main__
+# when app.py is the main script) and must not start pools of their own;
+# running app.py directly is handled below. Not warmed: processes forked
+# after import, such as gunicorn --preload workers or uWSGI workers without
+# lazy-apps, which get a fresh pool. Under "flask run --reload" the watcher
+# process, which never serves requests, warms a pool too.
+if __name__ not in ("__main__", "__mp_main__") and multiprocessing.parent_process() is None:
+    _warm_pool()
+
+
 if __name__ == "__main__":
     print("=" * 56)
     print("  Healthcare EDI and API Parser")
     print("  Formats: X12, HL7 v2, FHIR, CDA, NCPDP, CSV")
     print("  Open http://127.0.0.1:5000 in your browser")
     print("=" * 56)
+    # With the debug reloader, only the child process serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        _warm_pool()
     app.run(debug=True, port=5000)
@@ -1,6 +1,12 @@
 """Base EDI X12 parser — handles delimiter detection and segment splitting."""
 
 import re
+from functools import lru_cache
+
+# Deletion table for line breaks wrapped around or inside segments
+_LINE_BREAKS = str.maketrans("", "", "\r\n")
+# Marks a transaction type that hasn't been looked up yet (None is a result)
+_NOT_LOOKED_UP = object()
 
 
 class EDIFile:
@@ -12,14 +18,15 @@ class EDIFile:
         self.sub_element_sep = None
         self.segment_term = None
         self.segments = []
-        self._detect_delimiters()
-        self._split_segments()
-
-    def _detect_delimiters(self):
-        # Strip BOM and leading whitespace
+        self._txn_type = _NOT_LOOKED_UP  # Cached get_transaction_type() result
+        # Strip BOM and leading whitespace once for both passes below
+        # (the trailing end is already stripped)
         content = self.raw.lstrip("\ufeff").lstrip()
+        self._detect_delimiters(content)
+        self._split_segments(content)
 
-        if not content.upper().startswith("ISA"):
+    def _detect_delimiters(self, content):
+        if content[:3].upper() != "ISA":
             raise ValueError("File does not appear to be a valid EDI X12 file (missing ISA segment)")
 
         if len(content) < 106:
@@ -33,14 +40,16 @@ class EDIFile:
         self.sub_element_sep = content[104]
         self.segment_term = content[105]
 
-    def _split_segments(self):
-        content = self.raw.lstrip("\ufeff").strip()
-        # Split on segment terminator, then strip whitespace/newlines from each
-        raw_segments = content.split(self.segment_term)
-        for seg in raw_segments:
-            seg = seg.strip().replace("\n", "").replace("\r", "")
-            if seg:
-                self.segments.append(seg)
+    def _split_segments(self, content):
+        term = self.segment_term
+        if term in "\r\n":
+            # A line break is the terminator itself, so only drop the other one
+            line_breaks = str.maketrans("", "", "\r\n".replace(term, ""))
+        else:
+            line_breaks = _LINE_BREAKS
+        # Drop line breaks from the whole file in one pass, then split once
+        raw_segments = content.translate(line_breaks).split(term)
+        self.segments = [seg for seg in map(str.strip, raw_segments) if seg]
 
     def get_elements(self, segment_str):
         """Split a segment string into its elements."""
@@ -52,8 +61,15 @@ class EDIFile:
 
     def get_transaction_type(self):
         """Return the ST01 transaction type code (e.g., '835', '837', '270') or None."""
+        if self._txn_type is _NOT_LOOKED_UP:
+            self._txn_type = self._find_transaction_type()
+        return self._txn_type
+
+    def _find_transaction_type(self):
+        sep = self.element_sep
         for seg in self.segments:
-            elements = self.get_elements(seg)
+            # Only the segment ID and ST01 are needed, so stop splitting there
+            elements = seg.split(sep, 2)
             if elements[0].upper() == "ST":
                 return elements[1].strip() if len(elements) > 1 else None
         return None
@@ -62,9 +78,10 @@ class EDIFile:
         """Yield lists of segments for each ST..SE transaction."""
         current = []
         inside = False
+        sep = self.element_sep
         for seg in self.segments:
-            elements = self.get_elements(seg)
-            seg_id = elements[0].upper()
+            # Callers split the segments they consume; only the ID is needed here
+            seg_id = seg.partition(sep)[0].upper()
             if seg_id == "ST":
                 inside = True
                 current = [seg]
@@ -94,6 +111,7 @@ def safe_int(val, default=0):
         return default
 
 
+@lru_cache(maxsize=4096)
 def format_edi_date(date_str):
     """Convert CCYYMMDD or YYMMDD date string to MM/DD/YYYY."""
     if not date_str:
@@ -1,7 +1,9 @@
 """Generate readable Excel files from parsed EDI data."""
 
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
 from openpyxl.utils import get_column_letter
 
 
@@ -9,70 +11,130 @@ from openpyxl.utils import get_column_letter
 HEADER_FONT = Font(name="Calibri", bold=True, color="FFFFFF", size=11)
 HEADER_FILL = PatternFill(start_color="2B5797", end_color="2B5797", fill_type="solid")
 HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center", wrap_text=True)
+DATA_ALIGNMENT = Alignment(vertical="center")
 CURRENCY_FORMAT = '#,##0.00'
-THIN_BORDER = Border(
-    left=Side(style="thin", color="D0D0D0"),
-    right=Side(style="thin", color="D0D0D0"),
-    top=Side(style="thin", color="D0D0D0"),
-    bottom=Side(style="thin", color="D0D0D0"),
-)
+THIN_SIDE = Side(style="thin", color="D0D0D0")
+THIN_BORDER = Border(left=THIN_SIDE, right=THIN_SIDE, top=THIN_SIDE, bottom=THIN_SIDE)
 ALT_ROW_FILL = PatternFill(start_color="EBF1F8", end_color="EBF1F8", fill_type="solid")
 
+# Adjustment group code -> index into the [CO, PR, other] totals
+GROUP_BUCKETS = {"CO": 0, "PR": 1}
 
-def style_header(ws, num_cols):
-    """Apply header styling to the first row."""
-    for col in range(1, num_cols + 1):
-        cell = ws.cell(row=1, column=col)
+
+def header_cells(ws, headers):
+    """Build the styled header row."""
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
         cell.font = HEADER_FONT
         cell.fill = HEADER_FILL
         cell.alignment = HEADER_ALIGNMENT
         cell.border = THIN_BORDER
+        cells.append(cell)
+    return cells
 
 
-def style_data(ws, num_rows, num_cols, currency_cols=None):
-    """Apply data styling: alternating rows, borders, currency formatting."""
-    currency_cols = currency_cols or []
-    for row in range(2, num_rows + 1):
-        for col in range(1, num_cols + 1):
-            cell = ws.cell(row=row, column=col)
-            cell.border = THIN_BORDER
-            cell.alignment = Alignment(vertical="center")
-            if (row % 2) == 0:
-                cell.fill = ALT_ROW_FILL
-            if col in currency_cols:
-                cell.number_format = CURRENCY_FORMAT
-
-
-def auto_width(ws, num_cols, max_width=50):
-    """Auto-size column widths based on content."""
-    for col in range(1, num_cols + 1):
-        max_len = 0
-        for row in ws.iter_rows(min_col=col, max_col=col, values_only=False):
-            for cell in row:
-                val = str(cell.value) if cell.value is not None else ""
-                max_len = max(max_len, len(val))
-        adjusted = min(max_len + 3, max_width)
-        ws.column_dimensions[get_column_letter(col)].width = max(adjusted, 10)
+def data_style(wb, currency, alt_row):
+    """Register (once per workbook) and return the named style for data cells."""
+    name = "EDI Data"
+    if currency:
+        name += " Currency"
+    if alt_row:
+        name += " Alt"
+    if name not in wb.named_styles:
+        wb.add_named_style(NamedStyle(
+            name=name,
+            font=DEFAULT_FONT,
+            fill=ALT_ROW_FILL if alt_row else None,
+            border=THIN_BORDER,
+            alignment=DATA_ALIGNMENT,
+            number_format=CURRENCY_FORMAT if currency else None,
+        ))
+    return name
 
 
-def write_sheet(ws, headers, rows, currency_cols=None):
-    """Write a complete sheet with headers, data, and styling."""
-    # Write headers
-    for col_idx, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col_idx, value=header)
+def data_styles(ws, num_cols, currency_cols, alt_row):
+    """Build the per-column style names for one row parity.
 
-    # Write data
-    for row_idx, row_data in enumerate(rows, 2):
-        for col_idx, value in enumerate(row_data, 1):
-            ws.cell(row=row_idx, column=col_idx, value=value)
+    Setting style attributes goes through openpyxl's style registry on every
+    assignment, so each column's formatting is registered once as a named
+    style and data cells only get that name assigned.
+    """
+    plain = data_style(ws.parent, False, alt_row)
+    currency = data_style(ws.parent, True, alt_row)
+    return [currency if col in currency_cols else plain
+            for col in range(1, num_cols + 1)]
+
+
+def data_cells(ws, row_data, styles):
+    """Build one styled data row from the named styles of its parity."""
+    num_cols = len(styles)
+    values = list(row_data)
+    if len(values) < num_cols:
+        # Short rows still get a fully styled (empty) row
+        values.extend([None] * (num_cols - len(values)))
+    cells = []
+    for col, value in enumerate(values):
+        if col >= num_cols:
+            cells.append(value)
+            continue
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = styles[col]
+        cells.append(cell)
+    return cells
 
+
+def column_widths(headers, rows, max_width=50):
+    """Auto-size column widths based on header and row content."""
     num_cols = len(headers)
-    num_rows = len(rows) + 1
-    style_header(ws, num_cols)
-    style_data(ws, num_rows, num_cols, currency_cols)
-    auto_width(ws, num_cols)
+    _str = str
+    _len = len
+    max_len = [_len(_str(h)) if h is not None else 0 for h in headers]
+    for row_data in rows:
+        for col, value in enumerate(row_data):
+            if col >= num_cols:
+                break
+            if value.__class__ is _str:
+                length = _len(value)
+            elif value is not None:
+                length = _len(_str(value))
+            else:
+                continue
+            if length > max_len[col]:
+                max_len[col] = length
+    return [max(min(m + 3, max_width), 10) for m in max_len]
+
+
+def write_sheet(ws, headers, rows, currency_cols=None):
+    """Write a complete sheet with headers, data, and styling.
+
+    The worksheet is write-only, so column widths and the frozen header row
+    are set up front and each cell is styled as it is streamed out.
+    """
+    currency_cols = frozenset(currency_cols or ())
+    num_cols = len(headers)
+    # Indexed by row_idx & 1: even rows carry the alternating fill
+    row_styles = (
+        data_styles(ws, num_cols, currency_cols, alt_row=True),
+        data_styles(ws, num_cols, currency_cols, alt_row=False),
+    )
+
+    for col, width in enumerate(column_widths(headers, rows), 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
     ws.freeze_panes = "A2"
 
+    ws.append(header_cells(ws, headers))
+    for row_idx, row_data in enumerate(rows, 2):
+        ws.append(data_cells(ws, row_data, row_styles[row_idx & 1]))
+
+
+def adjustment_totals(adjustments):
+    """Sum adjustment amounts into [CO, PR, other] totals in a single pass."""
+    totals = [0.0, 0.0, 0.0]
+    for a in adjustments:
+        totals[GROUP_BUCKETS.get(a["group_code"], 2)] += a["amount"]
+    return totals
+
 
 # ---------------------------------------------------------------------------
 # Combined Excel Writer — handles multiple 835 and 837 files in one workbook
@@ -84,25 +146,21 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
     Args:
         all_835: list of (filename, parsed_transactions) tuples for 835 files
         all_837: list of (filename, parsed_transactions) tuples for 837 files
-        output_path: file path for the output Excel file
+        output_path: file path or writable binary file object for the output Excel file
         other_formats: list of (filename, format_name, sheets_list) tuples
             where sheets_list = [{"name": ..., "headers": [...], "rows": [...], "currency_cols": [...]}]
     """
     other_formats = other_formats or []
-    wb = Workbook()
-    first_sheet = True  # Track so we can rename the default sheet
+    # Write-only mode streams rows straight to the output instead of keeping
+    # every Cell object in memory until save
+    wb = Workbook(write_only=True)
 
     # -------------------------------------------------------------------
     # 835 sheets
     # -------------------------------------------------------------------
     if all_835:
         # --- 835 Payment Summary ---
-        if first_sheet:
-            ws_payment = wb.active
-            ws_payment.title = "835 Payment Summary"
-            first_sheet = False
-        else:
-            ws_payment = wb.create_sheet("835 Payment Summary")
+        ws_payment = wb.create_sheet("835 Payment Summary")
 
         payment_headers = [
             "Source File",
@@ -145,15 +203,12 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
                     insured_name = f"{c['insured_last_name']}, {c['insured_first_name']}".strip(", ")
                     rendering = f"{c['rendering_provider_last_name']}, {c['rendering_provider_first_name']}".strip(", ")
 
-                    adj_co = sum(a["amount"] for a in c["adjustments"] if a["group_code"] == "CO")
-                    adj_pr = sum(a["amount"] for a in c["adjustments"] if a["group_code"] == "PR")
-                    adj_oa = sum(a["amount"] for a in c["adjustments"]
-                                 if a["group_code"] not in ("CO", "PR"))
+                    adj_co, adj_pr, adj_oa = adjustment_totals(c["adjustments"])
                     for svc in c["service_lines"]:
-                        adj_co += sum(a["amount"] for a in svc["adjustments"] if a["group_code"] == "CO")
-                        adj_pr += sum(a["amount"] for a in svc["adjustments"] if a["group_code"] == "PR")
-                        adj_oa += sum(a["amount"] for a in svc["adjustments"]
-                                      if a["group_code"] not in ("CO", "PR"))
+                        co, pr, oa = adjustment_totals(svc["adjustments"])
+                        adj_co += co
+                        adj_pr += pr
+                        adj_oa += oa
 
                     claim_rows.append([
                         filename,
@@ -184,11 +239,13 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
             for txn in transactions:
                 for c in txn["claims"]:
                     for svc in c["service_lines"]:
+                        adjs = svc["adjustments"]
                         adj_summary = "; ".join(
-                            f"{a['group_code']}-{a['reason_code']}: ${a['amount']:.2f}"
-                            for a in svc["adjustments"]
-                        )
-                        remarks = ", ".join(svc.get("remark_codes", []))
+                            "%s-%s: $%.2f" % (a["group_code"], a["reason_code"], a["amount"])
+                            for a in adjs
+                        ) if adjs else ""
+                        remark_codes = svc.get("remark_codes")
+                        remarks = ", ".join(remark_codes) if remark_codes else ""
                         svc_rows.append([
                             filename,
                             svc["_claim_id"], svc["procedure_code"], svc["modifiers"],
@@ -212,20 +269,29 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
         for filename, transactions in all_835:
             for txn in transactions:
                 for c in txn["claims"]:
-                    for adj in c["adjustments"]:
+                    adjs = c["adjustments"]
+                    svc_lines = c["service_lines"]
+                    if not adjs and not svc_lines:
+                        continue
+                    pcn = c["patient_control_number"]
+                    for adj in adjs:
                         adj_rows.append([
                             filename,
-                            c["patient_control_number"], "Claim",
+                            pcn, "Claim",
                             adj["group_code"], adj["group_description"],
                             adj["reason_code"], adj["reason_description"],
                             adj["amount"], adj["quantity"],
                         ])
-                    for svc in c["service_lines"]:
-                        for adj in svc["adjustments"]:
+                    for svc in svc_lines:
+                        svc_adjs = svc["adjustments"]
+                        if not svc_adjs:
+                            continue
+                        level = f"Service ({svc['procedure_code']})"
+                        for adj in svc_adjs:
                             adj_rows.append([
                                 filename,
-                                c["patient_control_number"],
-                                f"Service ({svc['procedure_code']})",
+                                pcn,
+                                level,
                                 adj["group_code"], adj["group_description"],
                                 adj["reason_code"], adj["reason_description"],
                                 adj["amount"], adj["quantity"],
@@ -237,12 +303,7 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
     # -------------------------------------------------------------------
     if all_837:
         # --- 837 Claims ---
-        if first_sheet:
-            ws_claims = wb.active
-            ws_claims.title = "837 Claims"
-            first_sheet = False
-        else:
-            ws_claims = wb.create_sheet("837 Claims")
+        ws_claims = wb.create_sheet("837 Claims")
 
         claim_headers = [
             "Source File",
@@ -296,16 +357,18 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
         for filename, transactions in all_837:
             for txn in transactions:
                 for c in txn["claims"]:
+                    claim_id = c["claim_id"]
                     for svc in c["service_lines"]:
+                        _get = svc.get
                         svc_rows.append([
                             filename,
-                            svc.get("_claim_id", c["claim_id"]),
-                            svc.get("line_number", ""),
+                            _get("_claim_id", claim_id),
+                            _get("line_number", ""),
                             svc["procedure_code"], svc["modifiers"],
                             svc["charge_amount"], svc["units"], svc["unit_type"],
-                            svc.get("place_of_service", ""), svc.get("revenue_code", ""),
-                            svc.get("service_date_from", ""), svc.get("service_date_to", ""),
-                            svc.get("diagnosis_pointers", ""), svc.get("ndc_code", ""),
+                            _get("place_of_service", ""), _get("revenue_code", ""),
+                            _get("service_date_from", ""), _get("service_date_to", ""),
+                            _get("diagnosis_pointers", ""), _get("ndc_code", ""),
                         ])
         write_sheet(ws_svc, svc_headers, svc_rows, currency_cols=[6])
 
@@ -319,10 +382,11 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
         for filename, transactions in all_837:
             for txn in transactions:
                 for c in txn["claims"]:
+                    claim_id = c["claim_id"]
                     for dx in c["diagnosis_codes"]:
                         dx_rows.append([
                             filename,
-                            c["claim_id"], dx["code"], dx["type"], dx["qualifier"],
+                            claim_id, dx["code"], dx["type"], dx["qualifier"],
                         ])
         write_sheet(ws_dx, dx_headers, dx_rows)
 
@@ -343,20 +407,14 @@ def write_combined_excel(all_835, all_837, output_path, other_formats=None):
                         # Shift currency cols by 1 for the Source File column
                         "currency_cols": [c + 1 for c in sheet.get("currency_cols", [])],
                     }
-                for row in sheet["rows"]:
-                    merged[sname]["rows"].append([filename] + list(row))
+                merged[sname]["rows"].extend([filename, *row] for row in sheet["rows"])
 
         for sname, sdata in merged.items():
             # Excel sheet names max 31 chars, no special chars
             safe_name = sname[:31].replace("/", "-").replace("\\", "-")
             safe_name = safe_name.replace("[", "(").replace("]", ")").replace("*", "")
             safe_name = safe_name.replace("?", "").replace(":", "-")
-            if first_sheet:
-                ws = wb.active
-                ws.title = safe_name
-                first_sheet = False
-            else:
-                ws = wb.create_sheet(safe_name)
+            ws = wb.create_sheet(safe_name)
             write_sheet(ws, sdata["headers"], sdata["rows"],
                         currency_cols=sdata.get("currency_cols"))
 
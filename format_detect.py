@@ -3,6 +3,16 @@
 import json
 import re
 
+# NCPDP can start with a 6-digit BIN number followed by the version
+_NCPDP_BIN_RE = re.compile(r"\d{6}(51|D0)")
+# HL7 v2.x header segment followed by the field separator
+_HL7_HEADER_RE = re.compile(r"(MSH|FHS|BHS)[|^]")
+# JSON object whose first key is resourceType, as FHIR resources and Bundles
+# are written
+_FHIR_JSON_HEAD_RE = re.compile(r'\{\s*"resourceType"\s*:')
+# Below this size JSON is always deserialized to classify it
+_FHIR_JSON_SHORTCUT_MIN_SIZE = 1024 * 1024
+
 
 def detect_format(content):
     """Detect the healthcare data format of the given content.
@@ -30,55 +40,28 @@ def detect_format(content):
     if "\x1c" in content[:200] or "\x1d" in content[:200] or "\x1e" in content[:200]:
         # Contains NCPDP control characters
         return "ncpdp"
-    # NCPDP can also start with a 6-digit BIN number followed by version
-    if re.match(r"^\d{6}(51|D0)", stripped):
-        return "ncpdp"
 
-    # --- X12: starts with ISA ---
-    if stripped[:3].upper() == "ISA" and len(stripped) >= 106:
-        return "x12"
+    # The first character narrows the candidates to (usually) one format,
+    # so only that format's check runs
+    handler = _LEADING_CHAR_HANDLERS.get(stripped[:1])
+    if handler:
+        fmt = handler(stripped)
+        if fmt:
+            return fmt
 
-    # --- HL7 v2.x: starts with MSH, FHS, or BHS followed by field separator ---
-    if re.match(r"^(MSH|FHS|BHS)[|^]", stripped):
-        return "hl7v2"
-    # Also handle batch files that may have FHS/BHS before MSH
+    # Also handle HL7 batch files that may have FHS/BHS before MSH
     if "\nMSH|" in stripped or "\rMSH|" in stripped:
         return "hl7v2"
 
-    # --- JSON-based formats ---
-    if stripped.startswith("{") or stripped.startswith("["):
-        try:
-            data = json.loads(stripped)
-            if isinstance(data, dict):
-                if "resourceType" in data:
-                    return "fhir"
-                # Could be a FHIR Bundle
-                if data.get("resourceType") == "Bundle":
-                    return "fhir"
-            elif isinstance(data, list) and len(data) > 0:
-                if isinstance(data[0], dict) and "resourceType" in data[0]:
-                    return "fhir"
-            return "csv"  # Generic JSON treated as structured data
-        except (json.JSONDecodeError, ValueError):
-            pass
-
-    # --- XML-based formats ---
-    if stripped.startswith("<") or stripped.startswith("<?xml"):
-        lower = stripped[:2000].lower()
-        # FHIR XML
-        if "fhir" in lower or 'xmlns="http://hl7.org/fhir"' in stripped[:2000]:
-            return "fhir"
-        # CDA
-        if "clinicaldocument" in lower or "urn:hl7-org:v3" in lower:
-            return "cda"
-        # HL7 v3 (non-CDA)
-        if "urn:hl7-org:v3" in lower:
-            return "cda"  # Treat as CDA/v3
-        # Generic XML — treat as CSV/structured
-        return "csv"
-
     # --- CSV/TSV: contains commas or tabs in a structured pattern ---
-    lines = stripped.split("\n", 5)
+    # Only the first five lines are inspected; cutting at the fifth newline
+    # keeps split() from copying the rest of a large file into the last item
+    end = -1
+    for _ in range(5):
+        end = stripped.find("\n", end + 1)
+        if end < 0:
+            break
+    lines = (stripped[:end] if end >= 0 else stripped).split("\n")
     if len(lines) >= 2:
         # Check if it looks like delimited data
         for delim in [",", "\t", "|"]:
@@ -89,6 +72,85 @@ def detect_format(content):
     return None
 
 
+def _detect_ncpdp_bin(stripped):
+    # NCPDP can also start with a 6-digit BIN number followed by version
+    if _NCPDP_BIN_RE.match(stripped):
+        return "ncpdp"
+    return None
+
+
+def _detect_x12(stripped):
+    # X12 starts with ISA
+    if stripped[:3].upper() == "ISA" and len(stripped) >= 106:
+        return "x12"
+    return None
+
+
+def _detect_hl7v2(stripped):
+    # HL7 v2.x starts with MSH, FHS, or BHS followed by field separator
+    if _HL7_HEADER_RE.match(stripped):
+        return "hl7v2"
+    return None
+
+
+def _detect_json(stripped):
+    # FHIR resources and Bundles name their resourceType first, so for a
+    # large document looking at the head avoids deserializing a whole Bundle
+    # just to classify it. This check doesn't validate the JSON: a large
+    # document with such a head but a syntax error (e.g. a trailing comma)
+    # is still taken as FHIR, and the FHIR parser reports the error.
+    # Smaller documents, and unbalanced ones such as a truncated upload, are
+    # classified by json.loads below.
+    if (len(stripped) >= _FHIR_JSON_SHORTCUT_MIN_SIZE
+            and _FHIR_JSON_HEAD_RE.match(stripped) and stripped.endswith("}")
+            and stripped.count("{") == stripped.count("}")
+            and stripped.count("[") == stripped.count("]")):
+        return "fhir"
+    try:
+        data = json.loads(stripped)
+        if isinstance(data, dict):
+            if "resourceType" in data:
+                return "fhir"
+            # Could be a FHIR Bundle
+            if data.get("resourceType") == "Bundle":
+                return "fhir"
+        elif isinstance(data, list) and len(data) > 0:
+            if isinstance(data[0], dict) and "resourceType" in data[0]:
+                return "fhir"
+        return "csv"  # Generic JSON treated as structured data
+    except (json.JSONDecodeError, ValueError):
+        return None
+
+
+def _detect_xml(stripped):
+    # All checks run against one lowercased copy of the head
+    head = stripped[:2000].lower()
+    # FHIR XML (this also covers xmlns="http://hl7.org/fhir")
+    if "fhir" in head:
+        return "fhir"
+    # CDA, or other HL7 v3 (treated as CDA/v3)
+    if "clinicaldocument" in head or "urn:hl7-org:v3" in head:
+        return "cda"
+    # Generic XML — treat as CSV/structured
+    return "csv"
+
+
+# First character of the stripped content -> the check for the format(s)
+# that can start with it. A check returns None to fall through to the
+# batch-HL7 and delimited-text checks.
+_LEADING_CHAR_HANDLERS = {
+    **dict.fromkeys("0123456789", _detect_ncpdp_bin),
+    "I": _detect_x12,
+    "i": _detect_x12,
+    "M": _detect_hl7v2,
+    "F": _detect_hl7v2,
+    "B": _detect_hl7v2,
+    "{": _detect_json,
+    "[": _detect_json,
+    "<": _detect_xml,
+}
+
+
 def detect_x12_type(content):
     """For X12 content, detect the transaction set type from ST segment.
 
@@ -101,10 +163,17 @@ def detect_x12_type(content):
     element_sep = stripped[3]
     segment_term = stripped[105]
 
-    segments = stripped.split(segment_term)
-    for seg in segments:
-        seg = seg.strip().replace("\n", "").replace("\r", "")
-        parts = seg.split(element_sep)
+    # ST follows the ISA/GS headers, so walk the segments one at a time
+    # rather than splitting the whole file to find it
+    pos = 0
+    length = len(stripped)
+    while pos <= length:
+        end = stripped.find(segment_term, pos)
+        if end == -1:
+            end = length
+        seg = stripped[pos:end].strip().replace("\n", "").replace("\r", "")
+        parts = seg.split(element_sep, 2)
         if parts[0].upper() == "ST" and len(parts) > 1:
             return parts[1]
+        pos = end + 1
     return None
@@ -1,5 +1,7 @@
 """Parser for EDI 835 (Health Care Claim Payment/Remittance Advice)."""
 
+from sys import intern
+
 from edi_parser import EDIFile, safe_float, safe_int, format_edi_date
 
 # Claim status code descriptions
@@ -34,6 +36,37 @@ PAYMENT_METHODS = {
     "NON": "Non-Payment Data",
 }
 
+# N1 entity identifier -> (name field, id field) on the payment record
+N1_ENTITY_FIELDS = {
+    "PR": ("payer_name", "payer_id"),  # Payer
+    "PE": ("payee_name", "payee_id"),  # Payee
+}
+
+# NM1 entity identifier -> (last name field, first name field, id field or
+# None) on the claim record
+NM1_ENTITY_FIELDS = {
+    "QC": ("patient_last_name", "patient_first_name", None),  # Patient
+    "IL": ("insured_last_name", "insured_first_name", None),  # Insured/Subscriber
+    "74": ("corrected_insured_last_name", "corrected_insured_first_name", None),  # Corrected Insured
+    "82": ("rendering_provider_last_name", "rendering_provider_first_name",
+           "rendering_provider_npi"),  # Rendering Provider
+}
+
+# Claim-level DTM qualifiers and the claim field each one fills
+CLAIM_DATE_FIELDS = {
+    "050": "claim_received_date",
+    "232": "claim_statement_from",
+    "233": "claim_statement_to",
+    "036": "coverage_expiration_date",
+}
+
+# Service-line DTM qualifiers: 472 = Service Date, 150/151 = Service Period
+SERVICE_DATE_QUALIFIERS = frozenset(("472", "150", "151"))
+
+# LQ qualifiers that carry remark codes: HE = Claim Payment Remark Codes,
+# RX = NCPDP Reject/Payment Codes
+REMARK_CODE_QUALIFIERS = frozenset(("HE", "RX"))
+
 # Common Claim Adjustment Reason Codes (CARC)
 REASON_CODES = {
     "1": "Deductible",
@@ -233,6 +266,53 @@ REASON_CODES = {
 }
 
 
+# Blank claim and service line records. Each CLP/SVC starts from a copy of
+# these (much cheaper than building a 20-odd key literal per segment), so
+# every record keeps the same keys in the same order. The list fields are
+# filled with fresh lists on each copy.
+_CLAIM_TEMPLATE = {
+    "patient_control_number": "",
+    "claim_status": "",
+    "claim_status_code": "",
+    "total_charge": 0.0,
+    "payment_amount": 0.0,
+    "patient_responsibility": 0.0,
+    "filing_indicator": "",
+    "payer_claim_number": "",
+    "patient_last_name": "",
+    "patient_first_name": "",
+    "insured_last_name": "",
+    "insured_first_name": "",
+    "corrected_insured_last_name": "",
+    "corrected_insured_first_name": "",
+    "rendering_provider_last_name": "",
+    "rendering_provider_first_name": "",
+    "rendering_provider_npi": "",
+    "claim_received_date": "",
+    "claim_statement_from": "",
+    "claim_statement_to": "",
+    "coverage_expiration_date": "",
+    "adjustments": None,
+    "service_lines": None,
+}
+
+_SERVICE_TEMPLATE = {
+    "procedure_code": "",
+    "procedure_qualifier": "",
+    "modifiers": "",
+    "charge_amount": 0.0,
+    "payment_amount": 0.0,
+    "revenue_code": "",
+    "units_paid": 0.0,
+    "original_procedure_code": "",
+    "original_units": 0.0,
+    "service_date": "",
+    "adjustments": None,
+    "remark_codes": None,
+    "_claim_id": "",
+}
+
+
 def parse_835(edi_file):
     """Parse an 835 EDI file and return structured data.
 
@@ -242,223 +322,274 @@ def parse_835(edi_file):
     Returns:
         dict with payment info, claims, service lines, and adjustments
     """
-    results = []
+    # The workbook writer makes several passes over the transactions, and
+    # results cross process boundaries, so this returns a list; use
+    # iter_835() to consume one transaction at a time instead
+    return list(iter_835(edi_file))
 
+
+def iter_835(edi_file):
+    """Yield the parsed 835 transactions of an EDIFile one at a time.
+
+    Only the transaction being yielded is held in memory, so callers that
+    write each transaction out as they go (CSV, a database) can process
+    files far larger than parse_835() could keep.
+    """
     for transaction_segments in edi_file.get_transactions():
         result = _parse_transaction(edi_file, transaction_segments)
         if result:
-            results.append(result)
+            yield result
+
+
+# Segments get this many empty elements appended before dispatch, so handlers
+# index elements directly instead of guarding every access (BPR16 and CAS19,
+# the last element of the sixth CAS triplet, are the furthest elements read)
+ELEMENT_PAD_WIDTH = 20
+_ELEMENT_PAD = ("",) * ELEMENT_PAD_WIDTH
+
+# Element positions of the reason codes in CAS's (up to) six triplets
+_CAS_REASON_POSITIONS = range(2, 19, 3)
+
 
-    return results
+class _TransactionState:
+    """Mutable state shared by the segment handlers while parsing one ST..SE."""
+
+    __slots__ = ("edi", "payment", "claims", "current_claim", "current_svc", "context")
+
+    def __init__(self, edi):
+        self.edi = edi
+        self.payment = {
+            "payment_amount": 0.0,
+            "payment_method": "",
+            "payment_date": "",
+            "trace_number": "",
+            "payer_name": "",
+            "payer_id": "",
+            "payee_name": "",
+            "payee_id": "",
+        }
+        self.claims = []
+        self.current_claim = None
+        self.current_svc = None
+        self.context = "header"  # header, claim, service
 
 
 def _parse_transaction(edi, segments):
     """Parse a single 835 transaction (ST..SE)."""
-    payment = {
-        "payment_amount": 0.0,
-        "payment_method": "",
-        "payment_date": "",
-        "trace_number": "",
-        "payer_name": "",
-        "payer_id": "",
-        "payee_name": "",
-        "payee_id": "",
-    }
-    claims = []
-    current_claim = None
-    current_svc = None
-    context = "header"  # header, claim, service
+    state = _TransactionState(edi)
+    element_sep = edi.element_sep
+    handlers_get = _SEGMENT_HANDLERS.get
 
     for seg_str in segments:
-        elements = edi.get_elements(seg_str)
-        seg_id = elements[0].upper()
-
-        if seg_id == "BPR":
-            payment["payment_amount"] = safe_float(elements[2]) if len(elements) > 2 else 0.0
-            if len(elements) > 4:
-                method = elements[4]
-                payment["payment_method"] = PAYMENT_METHODS.get(method, method)
-            if len(elements) > 16:
-                payment["payment_date"] = format_edi_date(elements[16])
-
-        elif seg_id == "TRN":
-            if len(elements) > 2:
-                payment["trace_number"] = elements[2]
-
-        elif seg_id == "N1":
-            entity = elements[1] if len(elements) > 1 else ""
-            name = elements[2] if len(elements) > 2 else ""
-            id_code = elements[4] if len(elements) > 4 else ""
-            if entity == "PR":  # Payer
-                payment["payer_name"] = name
-                payment["payer_id"] = id_code
-            elif entity == "PE":  # Payee
-                payment["payee_name"] = name
-                payment["payee_id"] = id_code
-
-        elif seg_id == "DTM":
-            qualifier = elements[1] if len(elements) > 1 else ""
-            date_val = format_edi_date(elements[2]) if len(elements) > 2 else ""
-            # 405 = Production Date (payment date if BPR didn't have it)
-            if qualifier == "405" and not payment["payment_date"]:
-                payment["payment_date"] = date_val
-
-        elif seg_id == "CLP":
-            # Save previous claim
-            if current_claim:
-                if current_svc:
-                    current_claim["service_lines"].append(current_svc)
-                    current_svc = None
-                claims.append(current_claim)
-
-            current_claim = {
-                "patient_control_number": elements[1] if len(elements) > 1 else "",
-                "claim_status": "",
-                "claim_status_code": elements[2] if len(elements) > 2 else "",
-                "total_charge": safe_float(elements[3]) if len(elements) > 3 else 0.0,
-                "payment_amount": safe_float(elements[4]) if len(elements) > 4 else 0.0,
-                "patient_responsibility": safe_float(elements[5]) if len(elements) > 5 else 0.0,
-                "filing_indicator": elements[6] if len(elements) > 6 else "",
-                "payer_claim_number": elements[7] if len(elements) > 7 else "",
-                "patient_last_name": "",
-                "patient_first_name": "",
-                "insured_last_name": "",
-                "insured_first_name": "",
-                "corrected_insured_last_name": "",
-                "corrected_insured_first_name": "",
-                "rendering_provider_last_name": "",
-                "rendering_provider_first_name": "",
-                "rendering_provider_npi": "",
-                "claim_received_date": "",
-                "claim_statement_from": "",
-                "claim_statement_to": "",
-                "coverage_expiration_date": "",
-                "adjustments": [],
-                "service_lines": [],
-            }
-            status_code = current_claim["claim_status_code"]
-            current_claim["claim_status"] = CLAIM_STATUS.get(status_code, status_code)
-            context = "claim"
-            current_svc = None
-
-        elif seg_id == "NM1" and current_claim:
-            entity = elements[1] if len(elements) > 1 else ""
-            last_name = elements[3] if len(elements) > 3 else ""
-            first_name = elements[4] if len(elements) > 4 else ""
-            id_code = elements[9] if len(elements) > 9 else ""
-            if entity == "QC":  # Patient
-                current_claim["patient_last_name"] = last_name
-                current_claim["patient_first_name"] = first_name
-            elif entity == "IL":  # Insured/Subscriber
-                current_claim["insured_last_name"] = last_name
-                current_claim["insured_first_name"] = first_name
-            elif entity == "74":  # Corrected Insured
-                current_claim["corrected_insured_last_name"] = last_name
-                current_claim["corrected_insured_first_name"] = first_name
-            elif entity == "82":  # Rendering Provider
-                current_claim["rendering_provider_last_name"] = last_name
-                current_claim["rendering_provider_first_name"] = first_name
-                current_claim["rendering_provider_npi"] = id_code
-
-        elif seg_id == "SVC" and current_claim:
-            # Save previous service line
-            if current_svc:
-                current_claim["service_lines"].append(current_svc)
-
-            # SVC01 is composite: qualifier:code[:modifier[:modifier...]]
-            proc_composite = elements[1] if len(elements) > 1 else ""
-            sub = edi.get_sub_elements(proc_composite)
-            proc_qualifier = sub[0] if len(sub) > 0 else ""
-            proc_code = sub[1] if len(sub) > 1 else ""
-            modifiers = sub[2:] if len(sub) > 2 else []
-
-            # SVC06 is the original submitted procedure (if different)
-            orig_composite = elements[6] if len(elements) > 6 else ""
-            orig_sub = edi.get_sub_elements(orig_composite) if orig_composite else []
-            orig_code = orig_sub[1] if len(orig_sub) > 1 else ""
-
-            current_svc = {
-                "procedure_code": proc_code,
-                "procedure_qualifier": proc_qualifier,
-                "modifiers": ":".join(modifiers) if modifiers else "",
-                "charge_amount": safe_float(elements[2]) if len(elements) > 2 else 0.0,
-                "payment_amount": safe_float(elements[3]) if len(elements) > 3 else 0.0,
-                "revenue_code": elements[4] if len(elements) > 4 else "",
-                "units_paid": safe_float(elements[5]) if len(elements) > 5 else 0.0,
-                "original_procedure_code": orig_code,
-                "original_units": safe_float(elements[7]) if len(elements) > 7 else 0.0,
-                "service_date": "",
-                "adjustments": [],
-                "remark_codes": [],
-                # Carry forward claim info for flat service line view
-                "_claim_id": current_claim["patient_control_number"],
-            }
-            context = "service"
-
-        elif seg_id == "CAS":
-            group_code = elements[1] if len(elements) > 1 else ""
-            group_desc = CAS_GROUP_CODES.get(group_code, group_code)
-
-            # CAS can have up to 6 adjustment triplets (reason, amount, quantity)
-            i = 2
-            while i < len(elements) and i + 1 < len(elements):
-                reason = elements[i] if elements[i] else ""
-                amount = safe_float(elements[i + 1]) if i + 1 < len(elements) else 0.0
-                qty = safe_float(elements[i + 2]) if i + 2 < len(elements) else 0.0
-
-                if not reason:
-                    i += 3
-                    continue
-
-                adj = {
-                    "group_code": group_code,
-                    "group_description": group_desc,
-                    "reason_code": reason,
-                    "reason_description": REASON_CODES.get(reason, ""),
-                    "amount": amount,
-                    "quantity": qty,
-                }
-
-                if context == "service" and current_svc:
-                    current_svc["adjustments"].append(adj)
-                elif current_claim:
-                    current_claim["adjustments"].append(adj)
-
-                i += 3
-
-        elif seg_id == "DTM" and current_claim:
-            qualifier = elements[1] if len(elements) > 1 else ""
-            date_val = format_edi_date(elements[2]) if len(elements) > 2 else ""
-            if context == "service" and current_svc:
-                if qualifier in ("472", "150", "151"):
-                    current_svc["service_date"] = date_val
-            elif context == "claim":
-                if qualifier == "050":
-                    current_claim["claim_received_date"] = date_val
-                elif qualifier == "232":
-                    current_claim["claim_statement_from"] = date_val
-                elif qualifier == "233":
-                    current_claim["claim_statement_to"] = date_val
-                elif qualifier == "036":
-                    current_claim["coverage_expiration_date"] = date_val
-
-        elif seg_id == "AMT" and current_claim:
-            pass  # Could capture additional monetary amounts if needed
-
-        elif seg_id == "LQ" and current_svc:
-            qualifier = elements[1] if len(elements) > 1 else ""
-            code = elements[2] if len(elements) > 2 else ""
-            if qualifier in ("HE", "RX"):
-                current_svc["remark_codes"].append(code)
+        # Split inline rather than through edi.get_elements(): this loop runs
+        # once per segment, and the extra Python call is a measurable share
+        elements = seg_str.split(element_sep)
+        # Pad every segment so handlers can index any element they read;
+        # a plain extend is cheaper than sizing the pad to each segment
+        elements += _ELEMENT_PAD
+        # Segment IDs are uppercase in practice, so only normalize the case
+        # when the ID isn't found as-is
+        handler = handlers_get(elements[0]) or handlers_get(elements[0].upper())
+        if handler:
+            handler(state, elements)
 
     # Don't forget the last claim/service
+    current_claim = state.current_claim
     if current_claim:
-        if current_svc:
-            current_claim["service_lines"].append(current_svc)
-        claims.append(current_claim)
+        if state.current_svc:
+            current_claim["service_lines"].append(state.current_svc)
+        state.claims.append(current_claim)
 
     return {
         "transaction_type": "835",
-        "payment": payment,
-        "claims": claims,
+        "payment": state.payment,
+        "claims": state.claims,
     }
+
+
+# BPR and TRN can repeat in a transaction; a later, shorter segment only
+# sets the fields it actually carries. Element i was in the segment as
+# received when the padded list is longer than ELEMENT_PAD_WIDTH + i.
+def _handle_bpr(state, elements):
+    payment = state.payment
+    payment["payment_amount"] = safe_float(elements[2])
+    if len(elements) > ELEMENT_PAD_WIDTH + 4:
+        method = elements[4]
+        payment["payment_method"] = PAYMENT_METHODS.get(method, method)
+    if len(elements) > ELEMENT_PAD_WIDTH + 16:
+        payment["payment_date"] = format_edi_date(elements[16])
+
+
+def _handle_trn(state, elements):
+    if len(elements) > ELEMENT_PAD_WIDTH + 2:
+        state.payment["trace_number"] = elements[2]
+
+
+def _handle_n1(state, elements):
+    entity = elements[1]
+    fields = N1_ENTITY_FIELDS.get(entity)
+    if not fields:
+        return
+    name_field, id_field = fields
+    state.payment[name_field] = elements[2]
+    state.payment[id_field] = elements[4]
+
+
+def _handle_dtm(state, elements):
+    qualifier = elements[1]
+    date_val = format_edi_date(elements[2])
+    # 405 = Production Date (payment date if BPR didn't have it)
+    if qualifier == "405" and not state.payment["payment_date"]:
+        state.payment["payment_date"] = date_val
+    elif state.context == "service" and state.current_svc:
+        if qualifier in SERVICE_DATE_QUALIFIERS:
+            state.current_svc["service_date"] = date_val
+    elif state.context == "claim" and state.current_claim:
+        field = CLAIM_DATE_FIELDS.get(qualifier)
+        if field:
+            state.current_claim[field] = date_val
+
+
+def _handle_clp(state, elements):
+    # Save previous claim
+    if state.current_claim:
+        if state.current_svc:
+            state.current_claim["service_lines"].append(state.current_svc)
+        state.claims.append(state.current_claim)
+
+    current_claim = _CLAIM_TEMPLATE.copy()
+    current_claim["patient_control_number"] = elements[1]
+    current_claim["claim_status_code"] = elements[2]
+    current_claim["total_charge"] = safe_float(elements[3])
+    current_claim["payment_amount"] = safe_float(elements[4])
+    current_claim["patient_responsibility"] = safe_float(elements[5])
+    current_claim["filing_indicator"] = elements[6]
+    current_claim["payer_claim_number"] = elements[7]
+    current_claim["adjustments"] = []
+    current_claim["service_lines"] = []
+    status_code = current_claim["claim_status_code"]
+    current_claim["claim_status"] = CLAIM_STATUS.get(status_code, status_code)
+    state.current_claim = current_claim
+    state.current_svc = None
+    state.context = "claim"
+
+
+def _handle_nm1(state, elements):
+    current_claim = state.current_claim
+    if not current_claim:
+        return
+    entity = elements[1]
+    fields = NM1_ENTITY_FIELDS.get(entity)
+    if not fields:
+        return
+    last_field, first_field, id_field = fields
+    current_claim[last_field] = elements[3]
+    current_claim[first_field] = elements[4]
+    if id_field:
+        current_claim[id_field] = elements[9]
+
+
+def _handle_svc(state, elements):
+    current_claim = state.current_claim
+    if not current_claim:
+        return
+    # Save previous service line
+    if state.current_svc:
+        current_claim["service_lines"].append(state.current_svc)
+
+    # Composites are split inline (not via edi.get_sub_elements) to save a
+    # method call per composite
+    sub_sep = state.edi.sub_element_sep
+
+    # SVC01 is composite: qualifier:code[:modifier[:modifier...]]
+    sub = elements[1].split(sub_sep)
+    proc_qualifier = sub[0]
+    proc_code = sub[1] if len(sub) > 1 else ""
+    modifiers = sub[2:]
+
+    # SVC06 is the original submitted procedure (if different); only its
+    # code is kept, so stop splitting after it
+    orig_composite = elements[6]
+    orig_sub = orig_composite.split(sub_sep, 2) if orig_composite else ()
+    orig_code = orig_sub[1] if len(orig_sub) > 1 else ""
+
+    current_svc = _SERVICE_TEMPLATE.copy()
+    current_svc["procedure_code"] = proc_code
+    current_svc["procedure_qualifier"] = proc_qualifier
+    # Empty modifier positions would otherwise show up as stray colons
+    current_svc["modifiers"] = ":".join(filter(None, modifiers))
+    current_svc["charge_amount"] = safe_float(elements[2])
+    current_svc["payment_amount"] = safe_float(elements[3])
+    current_svc["revenue_code"] = elements[4]
+    current_svc["units_paid"] = safe_float(elements[5])
+    current_svc["original_procedure_code"] = orig_code
+    # SVC07 is only sent when the original units differ; skip the call when empty
+    orig_units = elements[7]
+    current_svc["original_units"] = safe_float(orig_units) if orig_units else 0.0
+    current_svc["adjustments"] = []
+    current_svc["remark_codes"] = []
+    # Carry forward claim info for flat service line view
+    current_svc["_claim_id"] = current_claim["patient_control_number"]
+    state.current_svc = current_svc
+    state.context = "service"
+
+
+def _handle_cas(state, elements):
+    if state.context == "service" and state.current_svc:
+        adjustments = state.current_svc["adjustments"]
+    elif state.current_claim:
+        adjustments = state.current_claim["adjustments"]
+    else:
+        return
+
+    # Group and reason codes repeat across a file's adjustments; interned,
+    # the records share one string per code (and pickle, for results sent
+    # back from pool workers, writes each code once)
+    group_code = intern(elements[1])
+    group_desc = CAS_GROUP_CODES.get(group_code, group_code)
+
+    reason_desc = REASON_CODES.get
+    to_float = safe_float
+
+    # CAS can have up to 6 adjustment triplets (reason, amount, quantity);
+    # a missing amount or quantity reads as 0
+    for i in _CAS_REASON_POSITIONS:
+        reason = elements[i]
+        if not reason:
+            continue
+        reason = intern(reason)
+        qty = elements[i + 2]
+        adjustments.append({
+            "group_code": group_code,
+            "group_description": group_desc,
+            "reason_code": reason,
+            "reason_description": reason_desc(reason, ""),
+            "amount": to_float(elements[i + 1]),
+            # Quantities are usually omitted; skip the call when empty
+            "quantity": to_float(qty) if qty else 0.0,
+        })
+
+
+def _handle_lq(state, elements):
+    current_svc = state.current_svc
+    if not current_svc:
+        return
+    qualifier = elements[1]
+    code = elements[2]
+    if qualifier in REMARK_CODE_QUALIFIERS:
+        current_svc["remark_codes"].append(code)
+
+
+# Segment ID -> handler(state, elements). Segments without an entry (AMT
+# included, whose extra monetary amounts aren't captured) are skipped.
+_SEGMENT_HANDLERS = {
+    "BPR": _handle_bpr,
+    "TRN": _handle_trn,
+    "N1": _handle_n1,
+    "DTM": _handle_dtm,
+    "CLP": _handle_clp,
+    "NM1": _handle_nm1,
+    "SVC": _handle_svc,
+    "CAS": _handle_cas,
+    "LQ": _handle_lq,
+}
@@ -1,5 +1,7 @@
 """Parser for EDI 837 (Health Care Claim)."""
 
+from sys import intern
+
 from edi_parser import EDIFile, safe_float, safe_int, format_edi_date
 
 # Place of service code descriptions
@@ -72,6 +74,50 @@ ENTITY_CODES = {
     "72": "Operating Provider",
 }
 
+# NM1 entity identifier -> (name field, NPI field) for the providers kept on
+# each claim
+CLAIM_PROVIDER_FIELDS = {
+    "82": ("rendering_provider_name", "rendering_provider_npi"),  # Rendering Provider
+    "DN": ("referring_provider_name", "referring_provider_npi"),  # Referring Provider
+    "77": ("service_facility_name", "service_facility_npi"),  # Service Facility
+}
+
+# Claim-level DTP qualifier -> (date field, range-end field or None)
+CLAIM_DATE_FIELDS = {
+    "431": ("service_date_from", "service_date_to"),  # Onset of Current Illness
+    "472": ("service_date_from", "service_date_to"),  # Service Date
+    "435": ("admission_date", None),  # Admission
+    "096": ("discharge_date", None),  # Discharge
+}
+
+# Service-line DTP qualifier -> (date field, range-end field or None)
+SERVICE_DATE_FIELDS = {
+    "472": ("service_date_from", "service_date_to"),  # Service Date
+    "150": ("service_date_from", "service_date_to"),  # Service Period Start
+    "151": ("service_date_from", "service_date_to"),  # Service Period End
+}
+
+# HI qualifiers marking the principal diagnosis (ICD-10 ABK, ICD-9 BK)
+PRINCIPAL_DX_QUALIFIERS = frozenset(("ABK", "BK"))
+
+# DMG03 gender code descriptions
+GENDER_CODES = {
+    "M": "Male",
+    "F": "Female",
+    "U": "Unknown",
+}
+
+# HL03 hierarchical level codes, kept as ints once read from the HL segment
+HL_BILLING_PROVIDER = 20
+HL_SUBSCRIBER = 22
+HL_PATIENT = 23
+HL_OTHER = 0  # Any other level code
+HL_LEVELS = {
+    "20": HL_BILLING_PROVIDER,
+    "22": HL_SUBSCRIBER,
+    "23": HL_PATIENT,
+}
+
 
 def parse_837(edi_file):
     """Parse an 837 EDI file and return structured data.
@@ -82,14 +128,157 @@ def parse_837(edi_file):
     Returns:
         list of dicts with claim data
     """
-    results = []
+    # The workbook writer makes several passes over the transactions, and
+    # results cross process boundaries, so this returns a list; use
+    # iter_837() to consume one transaction at a time instead
+    return list(iter_837(edi_file))
+
+
+def iter_837(edi_file):
+    """Yield the parsed 837 transactions of an EDIFile one at a time.
 
+    Only the transaction being yielded is held in memory, so bulk pipelines
+    that store each transaction's claims as they go don't need to keep a
+    whole batch file's worth of claims.
+    """
     for transaction_segments in edi_file.get_transactions():
         result = _parse_transaction(edi_file, transaction_segments)
         if result:
-            results.append(result)
+            yield result
+
+
+# Segments get this many empty elements appended before dispatch, so handlers
+# index elements directly instead of guarding every access (NM1/CLM/SBR09
+# are the furthest elements read)
+ELEMENT_PAD_WIDTH = 10
+_ELEMENT_PAD = ("",) * ELEMENT_PAD_WIDTH
+
+
+# Blank claim and service line records. Each CLM/SV1/SV2 starts from a copy
+# of these (much cheaper than building a 30-odd key literal per segment), so
+# every record keeps the same keys in the same order. The list fields are
+# filled with fresh lists on each copy.
+_CLAIM_TEMPLATE = {
+    "claim_id": "",
+    "total_charge": 0.0,
+    "place_of_service_code": "",
+    "place_of_service": "",
+    "frequency_code": "",
+    "provider_signature": "",
+    "assignment_code": "",
+    "benefits_assignment": "",
+    "release_of_info": "",
+    "diagnosis_codes": None,
+    "service_lines": None,
+    "service_date_from": "",
+    "service_date_to": "",
+    "admission_date": "",
+    "discharge_date": "",
+    "rendering_provider_name": "",
+    "rendering_provider_npi": "",
+    "referring_provider_name": "",
+    "referring_provider_npi": "",
+    "service_facility_name": "",
+    "service_facility_npi": "",
+    "prior_authorization": "",
+    "claim_original_ref": "",
+    # These get filled by _finalize_claim
+    "billing_provider_name": "",
+    "billing_provider_npi": "",
+    "billing_provider_tax_id": "",
+    "subscriber_name": "",
+    "subscriber_id": "",
+    "patient_name": "",
+    "patient_dob": "",
+    "patient_gender": "",
+    "payer_name": "",
+    "payer_id": "",
+}
+
+_SERVICE_TEMPLATE = {
+    "line_number": 0,
+    "procedure_code": "",
+    "procedure_qualifier": "",
+    "modifiers": "",
+    "charge_amount": 0.0,
+    "unit_type": "",
+    "units": 0.0,
+    "place_of_service": "",
+    "diagnosis_pointers": "",
+    "service_date_from": "",
+    "service_date_to": "",
+    "revenue_code": "",
+    "ndc_code": "",
+    "_claim_id": "",
+}
+
+
+class _Provider:
+    """Billing provider details (2000A/2010AA)."""
+
+    __slots__ = ("name", "npi", "tax_id", "address_line", "city", "state", "zip")
+
+    def __init__(self):
+        self.name = self.npi = self.tax_id = ""
+        self.address_line = self.city = self.state = self.zip = ""
+
+    def as_dict(self):
+        return {
+            "name": self.name, "npi": self.npi, "tax_id": self.tax_id,
+            "address_line": self.address_line, "city": self.city,
+            "state": self.state, "zip": self.zip,
+        }
+
+
+class _Subscriber:
+    """Subscriber details (2000B/2010BA/2010BB), shared by the claims under it.
+
+    Only copied into claims by _finalize_claim, never output itself, so it
+    is a slotted object rather than a dict.
+    """
+
+    __slots__ = ("name", "member_id", "dob", "gender",
+                 "address_line", "city", "state", "zip",
+                 "payer_name", "payer_id", "group_number", "group_name")
 
-    return results
+    def __init__(self):
+        self.name = self.member_id = self.dob = self.gender = ""
+        self.address_line = self.city = self.state = self.zip = ""
+        self.payer_name = self.payer_id = ""
+        self.group_number = self.group_name = ""
+
+
+class _Patient:
+    """Patient details (2000C/2010CA) when the patient isn't the subscriber."""
+
+    __slots__ = ("name", "dob", "gender", "address_line", "city", "state", "zip")
+
+    def __init__(self):
+        self.name = self.dob = self.gender = ""
+        self.address_line = self.city = self.state = self.zip = ""
+
+
+class _TransactionState:
+    """Mutable state shared by the segment handlers while parsing one ST..SE."""
+
+    __slots__ = ("edi", "claims", "billing_provider", "current_subscriber",
+                 "current_patient", "current_claim", "current_svc",
+                 "hl_level", "address_target", "sub_type")
+
+    def __init__(self, edi):
+        self.edi = edi
+        self.claims = []
+        # Current context tracking
+        self.billing_provider = _Provider()
+        self.current_subscriber = _Subscriber()
+        self.current_patient = None  # If different from subscriber
+        self.current_claim = None
+        self.current_svc = None
+        self.hl_level = None  # Current HL_* level; None before the first HL
+        # Record that N3/N4 addresses belong to; follows the HL level, and
+        # before any HL it is the billing provider
+        self.address_target = self.billing_provider
+        self.sub_type = None  # 837P, 837I, 837D
 
 
 def _parse_transaction(edi, segments):
@@ -101,391 +290,383 @@ def _parse_transaction(edi, segments):
     # level 22 = Subscriber
     # level 23 = Patient/Dependent
 
-    claims = []
-    providers = []
-
-    # Current context tracking
-    billing_provider = {
-        "name": "", "npi": "", "tax_id": "",
-        "address_line": "", "city": "", "state": "", "zip": "",
-    }
-    current_subscriber = {
-        "name": "", "member_id": "", "dob": "", "gender": "",
-        "address_line": "", "city": "", "state": "", "zip": "",
-        "payer_name": "", "payer_id": "",
-    }
-    current_patient = None  # If different from subscriber
-    current_claim = None
-    current_svc = None
-
-    hl_level = None  # Current HL level code
-    in_2310_loop = None  # Track NM1 context within claim
-    sub_type = None  # 837P, 837I, 837D
+    state = _TransactionState(edi)
+    element_sep = edi.element_sep
+    handlers_get = _SEGMENT_HANDLERS.get
 
     for seg_str in segments:
-        elements = edi.get_elements(seg_str)
-        seg_id = elements[0].upper()
-
-        if seg_id == "ST":
-            # Detect 837 subtype from ST03 (implementation reference)
-            ref = elements[3] if len(elements) > 3 else ""
-            if "222" in ref:
-                sub_type = "837P"
-            elif "223" in ref:
-                sub_type = "837I"
-            elif "224" in ref:
-                sub_type = "837D"
-            else:
-                sub_type = "837"
-
-        elif seg_id == "HL":
-            # Save any pending service/claim
-            if current_svc and current_claim:
-                current_claim["service_lines"].append(current_svc)
-                current_svc = None
-            if current_claim:
-                _finalize_claim(current_claim, billing_provider, current_subscriber, current_patient)
-                claims.append(current_claim)
-                current_claim = None
-
-            hl_level = elements[3] if len(elements) > 3 else ""
-            child_code = elements[4] if len(elements) > 4 else "0"
-
-            if hl_level == "22":
-                # New subscriber — reset
-                current_subscriber = {
-                    "name": "", "member_id": "", "dob": "", "gender": "",
-                    "address_line": "", "city": "", "state": "", "zip": "",
-                    "payer_name": "", "payer_id": "",
-                    "group_number": "", "group_name": "",
-                }
-                current_patient = None
-            elif hl_level == "23":
-                # Patient is different from subscriber
-                current_patient = {
-                    "name": "", "dob": "", "gender": "",
-                    "address_line": "", "city": "", "state": "", "zip": "",
-                }
-
-        elif seg_id == "SBR":
-            # Subscriber information
-            if len(elements) > 9:
-                current_subscriber["group_number"] = elements[3] if len(elements) > 3 else ""
-                current_subscriber["group_name"] = elements[4] if len(elements) > 4 else ""
-
-        elif seg_id == "PAT":
-            pass  # Patient relationship info if needed
-
-        elif seg_id == "NM1":
-            entity = elements[1] if len(elements) > 1 else ""
-            entity_type = elements[2] if len(elements) > 2 else ""
-            last_or_org = elements[3] if len(elements) > 3 else ""
-            first = elements[4] if len(elements) > 4 else ""
-            middle = elements[5] if len(elements) > 5 else ""
-            id_qualifier = elements[8] if len(elements) > 8 else ""
-            id_code = elements[9] if len(elements) > 9 else ""
-
-            if entity_type == "1":  # Person
-                name = f"{last_or_org}, {first}" + (f" {middle}" if middle else "")
-            else:
-                name = last_or_org
-
-            if entity == "85":  # Billing Provider
-                billing_provider["name"] = name
-                if id_qualifier == "XX":
-                    billing_provider["npi"] = id_code
-            elif entity == "IL":  # Subscriber
-                current_subscriber["name"] = name
-                if id_qualifier == "MI":
-                    current_subscriber["member_id"] = id_code
-                elif id_code:
-                    current_subscriber["member_id"] = id_code
-            elif entity == "QC":  # Patient
-                if current_patient is not None:
-                    current_patient["name"] = name
-                elif hl_level == "22":
-                    # Patient same as subscriber (QC in subscriber loop)
-                    pass
-            elif entity == "PR":  # Payer
-                current_subscriber["payer_name"] = name
-                current_subscriber["payer_id"] = id_code
-            elif entity == "82" and current_claim:  # Rendering Provider
-                current_claim["rendering_provider_name"] = name
-                current_claim["rendering_provider_npi"] = id_code
-            elif entity == "DN" and current_claim:  # Referring Provider
-                current_claim["referring_provider_name"] = name
-                current_claim["referring_provider_npi"] = id_code
-            elif entity == "77" and current_claim:  # Service Facility
-                current_claim["service_facility_name"] = name
-                current_claim["service_facility_npi"] = id_code
-
-        elif seg_id == "N3":
-            addr = elements[1] if len(elements) > 1 else ""
-            addr2 = elements[2] if len(elements) > 2 else ""
-            full_addr = f"{addr} {addr2}".strip() if addr2 else addr
-
-            if hl_level == "20" or (hl_level is None and not current_claim):
-                billing_provider["address_line"] = full_addr
-            elif hl_level == "23" and current_patient:
-                current_patient["address_line"] = full_addr
-            elif hl_level == "22":
-                current_subscriber["address_line"] = full_addr
-
-        elif seg_id == "N4":
-            city = elements[1] if len(elements) > 1 else ""
-            state = elements[2] if len(elements) > 2 else ""
-            zip_code = elements[3] if len(elements) > 3 else ""
-
-            if hl_level == "20" or (hl_level is None and not current_claim):
-                billing_provider["city"] = city
-                billing_provider["state"] = state
-                billing_provider["zip"] = zip_code
-            elif hl_level == "23" and current_patient:
-                current_patient["city"] = city
-                current_patient["state"] = state
-                current_patient["zip"] = zip_code
-            elif hl_level == "22":
-                current_subscriber["city"] = city
-                current_subscriber["state"] = state
-                current_subscriber["zip"] = zip_code
-
-        elif seg_id == "REF":
-            qualifier = elements[1] if len(elements) > 1 else ""
-            value = elements[2] if len(elements) > 2 else ""
-            if qualifier == "EI" and not current_claim:  # Employer ID
-                billing_provider["tax_id"] = value
-            elif qualifier == "1G" and current_claim:  # Prior Auth
-                current_claim["prior_authorization"] = value
-            elif qualifier == "G1" and current_claim:  # Prior Auth
-                current_claim["prior_authorization"] = value
-            elif qualifier == "D9" and current_claim:  # Claim ID
-                current_claim["claim_original_ref"] = value
-
-        elif seg_id == "DMG":
-            dob = format_edi_date(elements[2]) if len(elements) > 2 else ""
-            gender_code = elements[3] if len(elements) > 3 else ""
-            gender = {"M": "Male", "F": "Female", "U": "Unknown"}.get(gender_code, gender_code)
-
-            if hl_level == "23" and current_patient:
-                current_patient["dob"] = dob
-                current_patient["gender"] = gender
-            elif hl_level == "22":
-                current_subscriber["dob"] = dob
-                current_subscriber["gender"] = gender
-
-        elif seg_id == "CLM":
-            # Save previous claim's last service
-            if current_svc and current_claim:
-                current_claim["service_lines"].append(current_svc)
-                current_svc = None
-            if current_claim:
-                _finalize_claim(current_claim, billing_provider, current_subscriber, current_patient)
-                claims.append(current_claim)
-
-            claim_id = elements[1] if len(elements) > 1 else ""
-            charge = safe_float(elements[2]) if len(elements) > 2 else 0.0
-
-            # CLM05 is composite: facility_code:qualifier:frequency
-            pos_composite = elements[5] if len(elements) > 5 else ""
-            pos_parts = edi.get_sub_elements(pos_composite) if pos_composite else []
-            facility_code = pos_parts[0] if len(pos_parts) > 0 else ""
-            pos_desc = PLACE_OF_SERVICE.get(facility_code, facility_code)
-            frequency = pos_parts[2] if len(pos_parts) > 2 else ""
-
-            current_claim = {
-                "claim_id": claim_id,
-                "total_charge": charge,
-                "place_of_service_code": facility_code,
-                "place_of_service": pos_desc,
-                "frequency_code": frequency,
-                "provider_signature": elements[6] if len(elements) > 6 else "",
-                "assignment_code": elements[7] if len(elements) > 7 else "",
-                "benefits_assignment": elements[8] if len(elements) > 8 else "",
-                "release_of_info": elements[9] if len(elements) > 9 else "",
-                "diagnosis_codes": [],
-                "service_lines": [],
-                "service_date_from": "",
-                "service_date_to": "",
-                "admission_date": "",
-                "discharge_date": "",
-                "rendering_provider_name": "",
-                "rendering_provider_npi": "",
-                "referring_provider_name": "",
-                "referring_provider_npi": "",
-                "service_facility_name": "",
-                "service_facility_npi": "",
-                "prior_authorization": "",
-                "claim_original_ref": "",
-                # These get filled by _finalize_claim
-                "billing_provider_name": "",
-                "billing_provider_npi": "",
-                "billing_provider_tax_id": "",
-                "subscriber_name": "",
-                "subscriber_id": "",
-                "patient_name": "",
-                "patient_dob": "",
-                "patient_gender": "",
-                "payer_name": "",
-                "payer_id": "",
-            }
-
-        elif seg_id == "HI" and current_claim:
-            # Diagnosis codes — each element is composite: qualifier:code
-            for i in range(1, len(elements)):
-                if not elements[i]:
-                    continue
-                parts = edi.get_sub_elements(elements[i])
-                qualifier = parts[0] if len(parts) > 0 else ""
-                code = parts[1] if len(parts) > 1 else ""
-                if code:
-                    dx_type = "Principal" if qualifier in ("ABK", "BK") else "Other"
-                    current_claim["diagnosis_codes"].append({
-                        "code": code,
-                        "type": dx_type,
-                        "qualifier": qualifier,
-                    })
-
-        elif seg_id == "DTP":
-            qualifier = elements[1] if len(elements) > 1 else ""
-            fmt = elements[2] if len(elements) > 2 else ""
-            date_val = elements[3] if len(elements) > 3 else ""
-
-            if fmt == "RD8" and "-" in date_val:
-                # Date range: CCYYMMDD-CCYYMMDD
-                parts = date_val.split("-")
-                date_from = format_edi_date(parts[0])
-                date_to = format_edi_date(parts[1]) if len(parts) > 1 else ""
-            else:
-                date_from = format_edi_date(date_val)
-                date_to = ""
-
-            if current_svc:
-                if qualifier in ("472", "150", "151"):
-                    current_svc["service_date_from"] = date_from
-                    current_svc["service_date_to"] = date_to
-            elif current_claim:
-                if qualifier == "431":
-                    current_claim["service_date_from"] = date_from
-                    current_claim["service_date_to"] = date_to
-                elif qualifier == "472":
-                    current_claim["service_date_from"] = date_from
-                    current_claim["service_date_to"] = date_to
-                elif qualifier == "435":
-                    current_claim["admission_date"] = date_from
-                elif qualifier == "096":
-                    current_claim["discharge_date"] = date_from
-
-        elif seg_id == "SV1" and current_claim:
-            # Professional service line
-            if current_svc:
-                current_claim["service_lines"].append(current_svc)
-
-            proc_composite = elements[1] if len(elements) > 1 else ""
-            sub = edi.get_sub_elements(proc_composite)
-            proc_qualifier = sub[0] if len(sub) > 0 else ""
-            proc_code = sub[1] if len(sub) > 1 else ""
-            mod1 = sub[2] if len(sub) > 2 else ""
-            mod2 = sub[3] if len(sub) > 3 else ""
-            mod3 = sub[4] if len(sub) > 4 else ""
-            mod4 = sub[5] if len(sub) > 5 else ""
-            modifiers = ":".join(m for m in [mod1, mod2, mod3, mod4] if m)
-
-            charge = safe_float(elements[2]) if len(elements) > 2 else 0.0
-            unit_type = elements[3] if len(elements) > 3 else ""
-            units = safe_float(elements[4]) if len(elements) > 4 else 0.0
-            pos = elements[5] if len(elements) > 5 else ""
-            dx_pointers = elements[7] if len(elements) > 7 else ""
-
-            current_svc = {
-                "line_number": len(current_claim["service_lines"]) + 1,
-                "procedure_code": proc_code,
-                "procedure_qualifier": proc_qualifier,
-                "modifiers": modifiers,
-                "charge_amount": charge,
-                "unit_type": unit_type,
-                "units": units,
-                "place_of_service": PLACE_OF_SERVICE.get(pos, pos),
-                "diagnosis_pointers": dx_pointers,
-                "service_date_from": "",
-                "service_date_to": "",
-                "revenue_code": "",
-                "ndc_code": "",
-                "_claim_id": current_claim["claim_id"],
-            }
-
-        elif seg_id == "SV2" and current_claim:
-            # Institutional service line
-            if current_svc:
-                current_claim["service_lines"].append(current_svc)
-
-            revenue_code = elements[1] if len(elements) > 1 else ""
-            proc_composite = elements[2] if len(elements) > 2 else ""
-            sub = edi.get_sub_elements(proc_composite)
-            proc_code = sub[1] if len(sub) > 1 else ""
-            modifiers = ""
-
-            charge = safe_float(elements[3]) if len(elements) > 3 else 0.0
-            unit_type = elements[4] if len(elements) > 4 else ""
-            units = safe_float(elements[5]) if len(elements) > 5 else 0.0
-
-            current_svc = {
-                "line_number": len(current_claim["service_lines"]) + 1,
-                "procedure_code": proc_code,
-                "procedure_qualifier": sub[0] if sub else "",
-                "modifiers": modifiers,
-                "charge_amount": charge,
-                "unit_type": unit_type,
-                "units": units,
-                "place_of_service": "",
-                "diagnosis_pointers": "",
-                "service_date_from": "",
-                "service_date_to": "",
-                "revenue_code": revenue_code,
-                "ndc_code": "",
-                "_claim_id": current_claim["claim_id"],
-            }
-
-        elif seg_id == "LX" and current_claim:
-            # Line counter — save any pending service
-            if current_svc:
-                current_claim["service_lines"].append(current_svc)
-                current_svc = None
-
-        elif seg_id == "LIN" and current_svc:
-            # NDC info
-            if len(elements) > 2:
-                if elements[2] == "N4":
-                    current_svc["ndc_code"] = elements[3] if len(elements) > 3 else ""
+        # Split inline rather than through edi.get_elements() to save a
+        # Python call per segment
+        elements = seg_str.split(element_sep)
+        # Segment IDs are uppercase in practice, so only normalize the case
+        # when the ID isn't found as-is
+        handler = handlers_get(elements[0]) or handlers_get(elements[0].upper())
+        if not handler:
+            # Segments with no handler (PAT, SE, NTE, ...) are dropped
+            # before padding
+            continue
+        # Pad every handled segment so handlers can index any element they read
+        elements += _ELEMENT_PAD
+        handler(state, elements)
 
     # Save last claim/service
-    if current_svc and current_claim:
-        current_claim["service_lines"].append(current_svc)
-    if current_claim:
-        _finalize_claim(current_claim, billing_provider, current_subscriber, current_patient)
-        claims.append(current_claim)
+    _close_claim(state)
 
     return {
-        "transaction_type": sub_type or "837",
-        "billing_provider": billing_provider,
-        "claims": claims,
+        "transaction_type": state.sub_type or "837",
+        "billing_provider": state.billing_provider.as_dict(),
+        "claims": state.claims,
     }
 
 
-def _finalize_claim(claim, billing_provider, subscriber, patient):
-    """Copy provider/subscriber/patient info into the claim dict."""
-    claim["billing_provider_name"] = billing_provider.get("name", "")
-    claim["billing_provider_npi"] = billing_provider.get("npi", "")
-    claim["billing_provider_tax_id"] = billing_provider.get("tax_id", "")
-    claim["subscriber_name"] = subscriber.get("name", "")
-    claim["subscriber_id"] = subscriber.get("member_id", "")
-    claim["payer_name"] = subscriber.get("payer_name", "")
-    claim["payer_id"] = subscriber.get("payer_id", "")
-
-    if patient:
-        claim["patient_name"] = patient.get("name", "")
-        claim["patient_dob"] = patient.get("dob", "")
-        claim["patient_gender"] = patient.get("gender", "")
+def _close_claim(state):
+    """Attach the pending service line and file the current claim, if any."""
+    current_claim = state.current_claim
+    if state.current_svc and current_claim:
+        current_claim["service_lines"].append(state.current_svc)
+        state.current_svc = None
+    if current_claim:
+        _finalize_claim(current_claim, state.billing_provider,
+                        state.current_subscriber, state.current_patient)
+        state.claims.append(current_claim)
+        state.current_claim = None
+
+
+def _handle_st(state, elements):
+    # Detect 837 subtype from ST03 (implementation reference)
+    ref = elements[3]
+    if "222" in ref:
+        state.sub_type = "837P"
+    elif "223" in ref:
+        state.sub_type = "837I"
+    elif "224" in ref:
+        state.sub_type = "837D"
+    else:
+        state.sub_type = "837"
+
+
+def _handle_hl(state, elements):
+    # Save any pending service/claim
+    _close_claim(state)
+
+    hl_level = HL_LEVELS.get(elements[3], HL_OTHER)
+    state.hl_level = hl_level
+
+    if hl_level == HL_SUBSCRIBER:
+        # New subscriber — reset
+        state.current_subscriber = state.address_target = _Subscriber()
+        state.current_patient = None
+    elif hl_level == HL_PATIENT:
+        # Patient is different from subscriber
+        state.current_patient = state.address_target = _Patient()
+    elif hl_level == HL_BILLING_PROVIDER:
+        state.address_target = state.billing_provider
+    else:
+        state.address_target = None
+
+
+def _handle_sbr(state, elements):
+    # Subscriber information
+    if elements[9]:
+        state.current_subscriber.group_number = elements[3]
+        state.current_subscriber.group_name = elements[4]
+
+
+def _handle_nm1(state, elements):
+    entity = elements[1]
+
+    # Claim-level providers (2310 loops) only count inside a claim
+    provider_fields = CLAIM_PROVIDER_FIELDS.get(entity)
+    if provider_fields:
+        current_claim = state.current_claim
+        if current_claim:
+            name_field, npi_field = provider_fields
+            current_claim[name_field] = _nm1_name(elements)
+            current_claim[npi_field] = elements[9]
+        return
+
+    # Names are built per branch, so entities that aren't captured here
+    # (pay-to, supervising, ...) cost only the comparisons
+    if entity == "85":  # Billing Provider
+        state.billing_provider.name = _nm1_name(elements)
+        if elements[8] == "XX":
+            state.billing_provider.npi = elements[9]
+    elif entity == "IL":  # Subscriber
+        state.current_subscriber.name = _nm1_name(elements)
+        id_code = elements[9]
+        if elements[8] == "MI" or id_code:
+            state.current_subscriber.member_id = id_code
+    elif entity == "QC":  # Patient
+        # A QC in the subscriber loop (no separate patient) is the
+        # subscriber, who is already named
+        if state.current_patient is not None:
+            state.current_patient.name = _nm1_name(elements)
+    elif entity == "PR":  # Payer
+        state.current_subscriber.payer_name = _nm1_name(elements)
+        state.current_subscriber.payer_id = elements[9]
+
+
+def _nm1_name(elements):
+    """Display name from an NM1: 'Last, First[ Middle]' for people."""
+    last_or_org = elements[3]
+    if elements[2] != "1":  # Not a person
+        return last_or_org
+    first = elements[4]
+    middle = elements[5]
+    # One f-string per case, so the name is built in a single allocation
+    return f"{last_or_org}, {first} {middle}" if middle else f"{last_or_org}, {first}"
+
+
+def _handle_n3(state, elements):
+    target = state.address_target
+    if target is not None:
+        addr = elements[1]
+        addr2 = elements[2]
+        target.address_line = f"{addr} {addr2}".strip() if addr2 else addr
+
+
+def _handle_n4(state, elements):
+    target = state.address_target
+    if target is not None:
+        target.city = elements[1]
+        target.state = elements[2]
+        target.zip = elements[3]
+
+
+def _handle_ref(state, elements):
+    qualifier = elements[1]
+    value = elements[2]
+    current_claim = state.current_claim
+    if qualifier == "EI" and not current_claim:  # Employer ID
+        state.billing_provider.tax_id = value
+    elif qualifier == "1G" and current_claim:  # Prior Auth
+        current_claim["prior_authorization"] = value
+    elif qualifier == "G1" and current_claim:  # Prior Auth
+        current_claim["prior_authorization"] = value
+    elif qualifier == "D9" and current_claim:  # Claim ID
+        current_claim["claim_original_ref"] = value
+
+
+def _handle_dmg(state, elements):
+    dob = format_edi_date(elements[2])
+    gender_code = elements[3]
+    gender = GENDER_CODES.get(gender_code, gender_code)
+
+    hl_level = state.hl_level
+    if hl_level == HL_PATIENT and state.current_patient:
+        state.current_patient.dob = dob
+        state.current_patient.gender = gender
+    elif hl_level == HL_SUBSCRIBER:
+        state.current_subscriber.dob = dob
+        state.current_subscriber.gender = gender
+
+
+def _handle_clm(state, elements):
+    # Save previous claim's last service
+    _close_claim(state)
+    # Addresses after a CLM with no HL before it have no owner
+    if state.hl_level is None:
+        state.address_target = None
+
+    claim_id = elements[1]
+    charge = safe_float(elements[2])
+
+    # CLM05 is composite: facility_code:qualifier:frequency
+    pos_composite = elements[5]
+    # Only the first three components are read, so stop splitting after them
+    pos_parts = pos_composite.split(state.edi.sub_element_sep, 3) if pos_composite else ()
+    facility_code = pos_parts[0] if len(pos_parts) > 0 else ""
+    pos_desc = PLACE_OF_SERVICE.get(facility_code, facility_code)
+    frequency = pos_parts[2] if len(pos_parts) > 2 else ""
+
+    claim = _CLAIM_TEMPLATE.copy()
+    claim["claim_id"] = claim_id
+    claim["total_charge"] = charge
+    claim["place_of_service_code"] = facility_code
+    claim["place_of_service"] = pos_desc
+    claim["frequency_code"] = frequency
+    claim["provider_signature"] = elements[6]
+    claim["assignment_code"] = elements[7]
+    claim["benefits_assignment"] = elements[8]
+    claim["release_of_info"] = elements[9]
+    claim["diagnosis_codes"] = []
+    claim["service_lines"] = []
+    state.current_claim = claim
+
+
+def _handle_hi(state, elements):
+    current_claim = state.current_claim
+    if not current_claim:
+        return
+    # Diagnosis codes — each element is composite: qualifier:code. The
+    # loop runs per composite, so its lookups are bound once up front.
+    sub_sep = state.edi.sub_element_sep
+    add_dx = current_claim["diagnosis_codes"].append
+    for composite in elements[1:]:
+        if not composite:
+            continue
+        # Only the qualifier and code are used
+        parts = composite.split(sub_sep, 2)
+        code = parts[1] if len(parts) > 1 else ""
+        if code:
+            # A handful of qualifiers repeat across every diagnosis; interned,
+            # the records share them (and pickle writes each one once)
+            qualifier = intern(parts[0])
+            dx_type = "Principal" if qualifier in PRINCIPAL_DX_QUALIFIERS else "Other"
+            add_dx({
+                "code": code,
+                "type": dx_type,
+                "qualifier": qualifier,
+            })
+
+
+def _handle_dtp(state, elements):
+    qualifier = elements[1]
+    current_svc = state.current_svc
+    if current_svc:
+        target = current_svc
+        fields = SERVICE_DATE_FIELDS.get(qualifier)
     else:
-        claim["patient_name"] = subscriber.get("name", "")
-        claim["patient_dob"] = subscriber.get("dob", "")
-        claim["patient_gender"] = subscriber.get("gender", "")
+        target = state.current_claim
+        fields = CLAIM_DATE_FIELDS.get(qualifier) if target else None
+    # Dates that aren't kept are never formatted
+    if not fields:
+        return
+
+    fmt = elements[2]
+    date_val = elements[3]
+    if fmt == "RD8" and "-" in date_val:
+        # Date range: CCYYMMDD-CCYYMMDD
+        parts = date_val.split("-")
+        date_from = format_edi_date(parts[0])
+        date_to = format_edi_date(parts[1]) if len(parts) > 1 else ""
+    else:
+        date_from = format_edi_date(date_val)
+        date_to = ""
+
+    from_field, to_field = fields
+    target[from_field] = date_from
+    if to_field:
+        target[to_field] = date_to
+
+
+def _handle_sv1(state, elements):
+    current_claim = state.current_claim
+    if not current_claim:
+        return
+    # Professional service line
+    if state.current_svc:
+        current_claim["service_lines"].append(state.current_svc)
+
+    proc_composite = elements[1]
+    sub = proc_composite.split(state.edi.sub_element_sep)
+    proc_qualifier = sub[0] if len(sub) > 0 else ""
+    proc_code = sub[1] if len(sub) > 1 else ""
+    # Up to four modifiers follow the code; most lines have none, and
+    # filter() keeps the non-empty ones without a Python-level generator
+    modifiers = ":".join(filter(None, sub[2:6])) if len(sub) > 2 else ""
+
+    charge = safe_float(elements[2])
+    unit_type = elements[3]
+    units = safe_float(elements[4])
+    pos = elements[5]
+    dx_pointers = elements[7]
+
+    svc = _SERVICE_TEMPLATE.copy()
+    svc["line_number"] = len(current_claim["service_lines"]) + 1
+    svc["procedure_code"] = proc_code
+    svc["procedure_qualifier"] = proc_qualifier
+    svc["modifiers"] = modifiers
+    svc["charge_amount"] = charge
+    svc["unit_type"] = unit_type
+    svc["units"] = units
+    svc["place_of_service"] = PLACE_OF_SERVICE.get(pos, pos)
+    svc["diagnosis_pointers"] = dx_pointers
+    svc["_claim_id"] = current_claim["claim_id"]
+    state.current_svc = svc
+
+
+def _handle_sv2(state, elements):
+    current_claim = state.current_claim
+    if not current_claim:
+        return
+    # Institutional service line
+    if state.current_svc:
+        current_claim["service_lines"].append(state.current_svc)
+
+    revenue_code = elements[1]
+    proc_composite = elements[2]
+    sub = proc_composite.split(state.edi.sub_element_sep, 2)
+    proc_code = sub[1] if len(sub) > 1 else ""
+
+    charge = safe_float(elements[3])
+    unit_type = elements[4]
+    units = safe_float(elements[5])
+
+    svc = _SERVICE_TEMPLATE.copy()
+    svc["line_number"] = len(current_claim["service_lines"]) + 1
+    svc["procedure_code"] = proc_code
+    svc["procedure_qualifier"] = sub[0] if sub else ""
+    svc["charge_amount"] = charge
+    svc["unit_type"] = unit_type
+    svc["units"] = units
+    svc["revenue_code"] = revenue_code
+    svc["_claim_id"] = current_claim["claim_id"]
+    state.current_svc = svc
+
+
+def _handle_lx(state, elements):
+    # Line counter — save any pending service
+    current_claim = state.current_claim
+    if current_claim and state.current_svc:
+        current_claim["service_lines"].append(state.current_svc)
+        state.current_svc = None
+
+
+def _handle_lin(state, elements):
+    # NDC info
+    if state.current_svc and elements[2] == "N4":
+        state.current_svc["ndc_code"] = elements[3]
+
+
+# Segment ID -> handler(state, elements). Segments without an entry (PAT
+# included, whose relationship info isn't captured) are skipped.
+_SEGMENT_HANDLERS = {
+    "ST": _handle_st,
+    "HL": _handle_hl,
+    "SBR": _handle_sbr,
+    "NM1": _handle_nm1,
+    "N3": _handle_n3,
+    "N4": _handle_n4,
+    "REF": _handle_ref,
+    "DMG": _handle_dmg,
+    "CLM": _handle_clm,
+    "HI": _handle_hi,
+    "DTP": _handle_dtp,
+    "SV1": _handle_sv1,
+    "SV2": _handle_sv2,
+    "LX": _handle_lx,
+    "LIN": _handle_lin,
+}
+
+
+def _finalize_claim(claim, billing_provider, subscriber, patient):
+    """Copy provider/subscriber/patient info into the claim dict.
+
+    Runs as each claim closes: the billing provider and subscriber records
+    can still change afterwards (a later 2000A loop, or other-payer NM1s in
+    a following claim), so the claim takes a snapshot of them now.
+    """
+    claim["billing_provider_name"] = billing_provider.name
+    claim["billing_provider_npi"] = billing_provider.npi
+    claim["billing_provider_tax_id"] = billing_provider.tax_id
+    claim["subscriber_name"] = subscriber.name
+    claim["subscriber_id"] = subscriber.member_id
+    claim["payer_name"] = subscriber.payer_name
+    claim["payer_id"] = subscriber.payer_id
+
+    # Without a separate patient loop, the subscriber is the patient
+    person = patient or subscriber
+    claim["patient_name"] = person.name
+    claim["patient_dob"] = person.dob
+    claim["patient_gender"] = person.gender
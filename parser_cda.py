@@ -1,11 +1,81 @@
 """Parser for HL7 v3 / CDA (Clinical Document Architecture) XML documents."""
 
+import os
 import re
-import xml.etree.ElementTree as ET
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+
+try:
+    from lxml import etree as ET
+    HAVE_LXML = True
+except ImportError:  # lxml is an optional speedup
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
 
 
 # CDA namespace
 NS = {"cda": "urn:hl7-org:v3", "sdtc": "urn:hl7-org:sdtc"}
+_DEFAULT_NS = "{urn:hl7-org:v3}"  # As it prefixes element tags
+
+# Start of an XML document: optional BOM and whitespace, then markup
+_XML_START_RE = re.compile(r"\ufeff?\s*<")
+
+# Whole namespace declaration attributes (xmlns="..." / xmlns:p='...'),
+# stripped when a document fails to parse as-is. A bytes pattern runs on
+# the encoded document directly.
+_XMLNS_ATTR_RE = re.compile(rb"""\sxmlns(?::[\w.-]+)?\s*=\s*(?:"[^"]*"|'[^']*')""")
+
+# id/@root of a US Social Security Number
+SSN_OID = "2.16.840.1.113883.4.1"
+
+# Clinical act elements read from an entry, in order of preference
+ACT_TYPES = ("act", "observation", "substanceAdministration",
+             "procedure", "encounter", "organizer", "supply")
+
+# Sheets from recently parsed documents, keyed by a digest of their bytes,
+# so a retried or re-uploaded document isn't parsed again. Only documents up
+# to _RESULT_CACHE_MAX_DOC_SIZE are cached, since hashing and copying cost
+# the most on the largest ones, and the sizes of the cached documents are
+# kept under _RESULT_CACHE_MAX_BYTES in total (oldest evicted first).
+_RESULT_CACHE = OrderedDict()  # digest -> (document size, sheets)
+_RESULT_CACHE_MAX_DOC_SIZE = 1024 * 1024
+_RESULT_CACHE_MAX_BYTES = 4 * 1024 * 1024
+_RESULT_CACHE_LOCK = threading.Lock()
+_result_cache_bytes = 0
+
+if HAVE_LXML:
+    # Uploads are untrusted, so entities are never expanded and nothing is
+    # fetched over the network. Both are set explicitly because lxml before 5
+    # resolved external entities by default. Comments and processing
+    # instructions are dropped so the tree looks the same as one built by
+    # ElementTree. Nothing here resolves ID references, so libxml2 needn't
+    # build its ID table.
+    _PARSER_OPTIONS = {"resolve_entities": False, "no_network": True,
+                       "collect_ids": False,
+                       "remove_comments": True, "remove_pis": True}
+    _PARSER = ET.XMLParser(**_PARSER_OPTIONS)
+    # libxml2 refuses text nodes over 10 MB, which a large embedded base64
+    # attachment can exceed (ElementTree has no such limit). huge_tree lifts
+    # all of libxml2's size and depth limits, so only documents big enough to
+    # need it get this parser.
+    _HUGE_TREE_MIN_SIZE = 10_000_000
+    _HUGE_PARSER = ET.XMLParser(huge_tree=True, **_PARSER_OPTIONS)
+    # Last resort for documents neither parse attempt accepts. Recovery
+    # skips entity references once it has seen an error, so it is not used
+    # for documents that parse cleanly. Its input is malformed and the most
+    # likely to be hostile, so it keeps the entity and network settings
+    # above and never gets huge_tree, whatever the document's size.
+    _RECOVER_PARSER = ET.XMLParser(recover=True, **_PARSER_OPTIONS)
+else:
+    # ElementTree parsers can't be reused once closed, so each parse makes
+    # its own default one
+    _PARSER_OPTIONS = {}
+    _HUGE_TREE_MIN_SIZE = None
+    _PARSER = None
+    _HUGE_PARSER = None
+    _RECOVER_PARSER = None
 
 
 def parse_cda(content):
@@ -14,22 +84,192 @@ def parse_cda(content):
     Returns:
         list of sheet dicts
     """
+    if isinstance(content, str) and not _XML_START_RE.match(content):
+        # Not XML at all: skip the encode and the parse attempts below
+        return []
+    raw = content.encode("utf-8") if isinstance(content, str) else content
+    size = len(raw)
+    if size > _RESULT_CACHE_MAX_DOC_SIZE:
+        return _parse_raw(raw)
+
+    key = blake2b(raw, digest_size=16).digest()
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(key)
+        if cached is not None:
+            _RESULT_CACHE.move_to_end(key)
+    if cached is not None:
+        return _copy_sheets(cached[1])
+
+    sheets = _parse_raw(raw)
+    _cache_result(key, size, _copy_sheets(sheets))
+    return sheets
+
+
+def _cache_result(key, size, sheets):
+    """Store a document's sheets, evicting the oldest entries over budget."""
+    global _result_cache_bytes
+    with _RESULT_CACHE_LOCK:
+        previous = _RESULT_CACHE.pop(key, None)
+        if previous is not None:
+            _result_cache_bytes -= previous[0]
+        _RESULT_CACHE[key] = (size, sheets)
+        _result_cache_bytes += size
+        while _result_cache_bytes > _RESULT_CACHE_MAX_BYTES:
+            old_size, _ = _RESULT_CACHE.popitem(last=False)[1]
+            _result_cache_bytes -= old_size
+
+
+def _parse_raw(raw):
+    """Parse encoded CDA XML into sheet data."""
+    parser = _PARSER
+    if _HUGE_PARSER is not None and len(raw) > _HUGE_TREE_MIN_SIZE:
+        parser = _HUGE_PARSER
     try:
-        root = ET.fromstring(content.encode("utf-8") if isinstance(content, str) else content)
+        root = ET.fromstring(raw, parser)
     except ET.ParseError:
         # Try stripping namespace-heavy content
         try:
-            cleaned = re.sub(r'xmlns[^"]*="[^"]*"', '', content)
-            root = ET.fromstring(cleaned.encode("utf-8") if isinstance(cleaned, str) else cleaned)
+            root = ET.fromstring(_XMLNS_ATTR_RE.sub(b"", raw), parser)
         except ET.ParseError:
-            return []
+            root = _recover(raw)
+            if root is None:
+                return []
+
+    ns = _detect_namespace(root)
+
+    # --- Document Info, Patient Demographics, Authors ---
+    sheets = _parse_header(root, ns)
+
+    # --- Document Sections and Structured Entries (if present) ---
+    sections, entries = _parse_body(root, ns)
+    if sections:
+        sheets.append(sections)
+    sheets.extend(entries)
+
+    return sheets
+
+
+def _copy_sheets(sheets):
+    """Copy sheet dicts down to their row lists.
 
-    # Detect namespace
+    Cached results are copied going in and coming out, so callers can't
+    change what a later parse of the same document returns.
+    """
+    return [{**sheet,
+             "headers": list(sheet["headers"]),
+             "rows": [list(row) for row in sheet["rows"]],
+             "currency_cols": list(sheet["currency_cols"])}
+            for sheet in sheets]
+
+
+def parse_cda_stream(source):
+    """Parse a CDA document from a file path or binary file object.
+
+    Returns the same sheets as parse_cda(), but the sections of the document
+    body are processed as they are read and then discarded, so memory peaks
+    at about the largest section instead of the whole document. Documents
+    that aren't well-formed XML give no sheets (parse_cda() is more
+    forgiving there).
+
+    Returns:
+        list of sheet dicts
+    """
+    root = None
     ns = ""
+    body = None  # First structuredBody, when it sits at component/structuredBody
+    seen_body = False
+    open_elems = []
+    section_rows = []
+    entry_sheets = []
+    streamed = False
+
+    try:
+        for event, elem in _iterparse(source):
+            if event == "start":
+                if root is None:
+                    root = elem
+                    ns = _detect_namespace(root)
+                elif not seen_body and _local_name(elem.tag, ns) == "structuredBody":
+                    # Only the first structuredBody is read, as parse_cda() does
+                    seen_body = True
+                    if (len(open_elems) == 2
+                            and _local_name(open_elems[1].tag, ns) == "component"):
+                        body = elem
+                open_elems.append(elem)
+                continue
+
+            open_elems.pop()
+            if (body is not None and len(open_elems) == 3 and open_elems[2] is body
+                    and elem.tag == f"{ns}component"):
+                # A body component is complete: take its section row and
+                # entry sheet, then drop its subtree
+                streamed = True
+                row, sheet = _parse_component(elem, ns)
+                if row:
+                    section_rows.append(row)
+                if sheet:
+                    entry_sheets.append(sheet)
+                elem.clear()
+    except ET.ParseError:
+        return []
+
+    sheets = _parse_header(root, ns)
+    if streamed:
+        sections = _sections_sheet(section_rows)
+    else:
+        # No components in the usual place; nothing was discarded, so read
+        # the body the same way parse_cda() does
+        sections, entry_sheets = _parse_body(root, ns)
+    if sections:
+        sheets.append(sections)
+    sheets.extend(entry_sheets)
+    return sheets
+
+
+def _iterparse(source):
+    """iterparse() over start and end events, with the same options as _PARSER.
+
+    As in parse_cda(), huge_tree is only turned on for a source known to be
+    over the size limit; a non-seekable stream keeps libxml2's limits.
+    """
+    options = _PARSER_OPTIONS
+    if HAVE_LXML and _source_size(source) > _HUGE_TREE_MIN_SIZE:
+        options = {**options, "huge_tree": True}
+    return ET.iterparse(source, events=("start", "end"), **options)
+
+
+def _source_size(source):
+    """Bytes left in a file path or seekable file object; 0 if unknown."""
+    try:
+        if isinstance(source, (str, bytes, os.PathLike)):
+            return os.path.getsize(source)
+        pos = source.tell()
+        size = source.seek(0, os.SEEK_END)
+        source.seek(pos)
+        return size - pos
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def _detect_namespace(root):
+    """The "{uri}" prefix of the root element's tag, or "" if it has none."""
     tag = root.tag
+    # Nearly every document is in the CDA namespace; handing back the one
+    # shared string also keeps the per-namespace caches on a single key
+    if tag.startswith(_DEFAULT_NS):
+        return _DEFAULT_NS
     if "}" in tag:
-        ns = tag.split("}")[0] + "}"
+        return tag.split("}")[0] + "}"
+    return ""
+
+
+def _local_name(tag, ns):
+    """Tag without the document namespace (other namespaces are kept)."""
+    return tag[len(ns):] if ns and tag.startswith(ns) else tag
 
+
+def _parse_header(root, ns):
+    """Sheets for the document header: document info, patients and authors."""
     sheets = []
 
     # --- Document Info ---
@@ -47,76 +287,173 @@ def parse_cda(content):
     if author_info:
         sheets.append(author_info)
 
-    # --- Document Sections ---
-    sections = _parse_sections(root, ns)
-    if sections:
-        sheets.append(sections)
-
-    # --- Structured Entries (if present) ---
-    entries = _parse_entries(root, ns)
-    if entries:
-        sheets.extend(entries)
-
     return sheets
 
 
-def _find(elem, path, ns):
-    """Find element using namespace-aware path."""
-    if ns:
-        # Convert simple path to namespace-qualified
-        parts = path.split("/")
-        ns_path = "/".join(f"{ns}{p}" if p and not p.startswith("{") and not p.startswith(".")
-                           else p for p in parts)
-        result = elem.find(ns_path)
-        if result is not None:
-            return result
-    return elem.find(path)
+def _recover(raw):
+    """Salvage what lxml can from malformed XML; None if it can't (or no lxml)."""
+    if _RECOVER_PARSER is None:
+        return None
+    try:
+        return ET.fromstring(raw, _RECOVER_PARSER)
+    except ET.ParseError:
+        return None
+
 
+# The same few dozen literal paths are looked up for every element, so each
+# is qualified (and, under lxml, compiled to XPath) once per namespace
+@lru_cache(maxsize=256)
+def _ns_path(path, ns):
+    """Namespace-qualify each step of a simple path ("a/b" -> "{ns}a/{ns}b")."""
+    return "/".join(f"{ns}{p}" if p and not p.startswith("{") and not p.startswith(".")
+                    else p for p in path.split("/"))
+
+
+if HAVE_LXML:
+    @lru_cache(maxsize=256)
+    def _xpath(path):
+        """Compiled XPath for a (qualified) path, built once per path."""
+        # ETXPath takes the {namespace}tag form _ns_path produces
+        return ET.ETXPath(path)
+
+    def _find(elem, path, ns):
+        """Find element using namespace-aware path."""
+        if ns:
+            result = _xpath(_ns_path(path, ns))(elem)
+            if result:
+                return result[0]
+        result = _xpath(path)(elem)
+        return result[0] if result else None
+
+    def _findall(elem, path, ns):
+        """Find all elements using namespace-aware path."""
+        if ns:
+            result = _xpath(_ns_path(path, ns))(elem)
+            if result:
+                return result
+        return _xpath(path)(elem)
+
+    def _child(elem, name, ns):
+        """First child with the given local name (namespaced, else bare)."""
+        if ns:
+            for child in elem.iterchildren(ns + name):
+                return child
+        for child in elem.iterchildren(name):
+            return child
+        return None
 
-def _findall(elem, path, ns):
-    """Find all elements using namespace-aware path."""
-    if ns:
-        parts = path.split("/")
-        ns_path = "/".join(f"{ns}{p}" if p and not p.startswith("{") and not p.startswith(".")
-                           else p for p in parts)
-        result = elem.findall(ns_path)
-        if result:
-            return result
-    return elem.findall(path)
+    def _children(elem, name, ns):
+        """Children with the given local name (namespaced, else bare)."""
+        if ns:
+            children = list(elem.iterchildren(ns + name))
+            if children:
+                return children
+        return list(elem.iterchildren(name))
+
+    # Each iterchildren() call builds a proxy for every child it walks, so
+    # records that read several fields look them all up in one pass
+    def _first_children(elem, names, ns):
+        """_child() for each of names, reading elem's children once."""
+        qualified = {}
+        bare = {}
+        ns_len = len(ns)
+        for child in elem:
+            tag = child.tag
+            if ns and tag[:ns_len] == ns:
+                qualified.setdefault(tag[ns_len:], child)
+            elif tag[:1] != "{":
+                bare.setdefault(tag, child)
+        return [qualified[name] if name in qualified else bare.get(name)
+                for name in names]
+
+else:
+    def _find(elem, path, ns):
+        """Find element using namespace-aware path."""
+        if ns:
+            result = elem.find(_ns_path(path, ns))
+            if result is not None:
+                return result
+        return elem.find(path)
+
+    def _findall(elem, path, ns):
+        """Find all elements using namespace-aware path."""
+        if ns:
+            result = elem.findall(_ns_path(path, ns))
+            if result:
+                return result
+        return elem.findall(path)
+
+    # A bare {ns}tag takes ElementTree's C child scan, skipping the path
+    # engine that find() uses for anything else
+    def _child(elem, name, ns):
+        """First child with the given local name (namespaced, else bare)."""
+        if ns:
+            child = elem.find(ns + name)
+            if child is not None:
+                return child
+        return elem.find(name)
+
+    def _children(elem, name, ns):
+        """Children with the given local name (namespaced, else bare)."""
+        if ns:
+            children = elem.findall(ns + name)
+            if children:
+                return children
+        return elem.findall(name)
+
+    def _first_children(elem, names, ns):
+        """_child() for each of names."""
+        found = []
+        for name in names:
+            child = elem.find(ns + name) if ns else None
+            if child is None:
+                child = elem.find(name)
+            found.append(child)
+        return found
 
 
 def _get_text(elem):
     """Get all text content from an element and its children."""
     if elem is None:
         return ""
-    texts = []
-    if elem.text and elem.text.strip():
-        texts.append(elem.text.strip())
-    for child in elem:
-        child_text = _get_text(child)
-        if child_text:
-            texts.append(child_text)
-        if child.tail and child.tail.strip():
-            texts.append(child.tail.strip())
-    return " ".join(texts)
+    # itertext() walks the subtree in C, yielding each text and tail in
+    # document order
+    return " ".join(text for text in map(str.strip, elem.itertext()) if text)
 
 
-def _get_attr(elem, attr, default=""):
-    """Get attribute value from element."""
-    if elem is None:
-        return default
-    return elem.get(attr, default)
+def _get_leaf_text(elem):
+    """_get_text() for elements that normally hold only a text node."""
+    if len(elem):
+        return _get_text(elem)
+    text = elem.text
+    return text.strip() if text else ""
+
+
+def _get_text_preview(elem, limit):
+    """Like _get_text(), but cut to limit characters plus "..." when longer.
+
+    Stops reading the subtree as soon as the text is known to be too long.
+    """
+    texts = []
+    length = -1  # Length of " ".join(texts)
+    for text in map(str.strip, elem.itertext()):
+        if text:
+            texts.append(text)
+            length += len(text) + 1
+            if length > limit:
+                return " ".join(texts)[:limit] + "..."
+    return " ".join(texts)
 
 
 def _parse_name(name_elem, ns):
     """Parse a CDA name element (given/family)."""
     if name_elem is None:
         return ""
-    given_elems = _findall(name_elem, "given", ns)
-    family_elem = _find(name_elem, "family", ns)
+    given_elems = _children(name_elem, "given", ns)
+    family_elem = _child(name_elem, "family", ns)
 
-    given = " ".join(_get_text(g) for g in given_elems) if given_elems else ""
-    family = _get_text(family_elem) if family_elem is not None else ""
+    given = " ".join(_get_leaf_text(g) for g in given_elems) if given_elems else ""
+    family = _get_leaf_text(family_elem) if family_elem is not None else ""
 
     if family and given:
         return f"{family}, {given}"
@@ -129,9 +466,9 @@ def _parse_addr(addr_elem, ns):
         return ""
     parts = []
     for tag in ["streetAddressLine", "city", "state", "postalCode", "country"]:
-        elem = _find(addr_elem, tag, ns)
+        elem = _child(addr_elem, tag, ns)
         if elem is not None:
-            text = _get_text(elem)
+            text = _get_leaf_text(elem)
             if text:
                 parts.append(text)
     if parts:
@@ -157,45 +494,50 @@ def _parse_document_info(root, ns):
     """Extract document-level metadata."""
     headers = ["Field", "Value"]
     rows = []
+    title, code, eff, conf, lang, doc_id, custodian = _first_children(
+        root, ("title", "code", "effectiveTime", "confidentialityCode",
+               "languageCode", "id", "custodian"), ns)
 
     # Title
-    title = _find(root, "title", ns)
     if title is not None:
         rows.append(["Document Title", _get_text(title)])
 
     # Type/Code
-    code = _find(root, "code", ns)
     if code is not None:
         code_val = code.get("code", "")
         display = code.get("displayName", "")
         rows.append(["Document Type", f"{code_val} — {display}" if display else code_val])
 
     # Effective time
-    eff = _find(root, "effectiveTime", ns)
     if eff is not None:
         rows.append(["Document Date", eff.get("value", "")])
 
     # Confidentiality
-    conf = _find(root, "confidentialityCode", ns)
     if conf is not None:
         rows.append(["Confidentiality", conf.get("displayName", conf.get("code", ""))])
 
     # Language
-    lang = _find(root, "languageCode", ns)
     if lang is not None:
         rows.append(["Language", lang.get("code", "")])
 
     # Document ID
-    doc_id = _find(root, "id", ns)
     if doc_id is not None:
         rows.append(["Document ID", doc_id.get("extension", doc_id.get("root", ""))])
 
     # Custodian
-    custodian = _find(root, "custodian", ns)
     if custodian is not None:
-        org_name = _find(custodian, ".//name", ns)
+        # The name normally sits at
+        # assignedCustodian/representedCustodianOrganization/name
+        org_name = None
+        org = _child(custodian, "assignedCustodian", ns)
+        if org is not None:
+            org = _child(org, "representedCustodianOrganization", ns)
+            if org is not None:
+                org_name = _child(org, "name", ns)
+        if org_name is None:
+            org_name = _find(custodian, ".//name", ns)
         if org_name is not None:
-            rows.append(["Custodian", _get_text(org_name)])
+            rows.append(["Custodian", _get_leaf_text(org_name)])
 
     if not rows:
         return None
@@ -204,7 +546,7 @@ def _parse_document_info(root, ns):
 
 def _parse_patient(root, ns):
     """Extract patient demographics from recordTarget."""
-    record_targets = _findall(root, "recordTarget", ns)
+    record_targets = _children(root, "recordTarget", ns)
     if not record_targets:
         return None
 
@@ -213,61 +555,52 @@ def _parse_patient(root, ns):
     rows = []
 
     for rt in record_targets:
-        patient_role = _find(rt, "patientRole", ns)
+        patient_role = _child(rt, "patientRole", ns)
         if patient_role is None:
             continue
 
-        patient = _find(patient_role, "patient", ns)
+        patient, addr = _first_children(patient_role, ("patient", "addr"), ns)
 
         # IDs
-        ids = _findall(patient_role, "id", ns)
+        ids = _children(patient_role, "id", ns)
         mrn = ssn = ""
         for id_elem in ids:
             ext = id_elem.get("extension", "")
             root_oid = id_elem.get("root", "")
-            if "2.16.840.1.113883.4.1" in root_oid:  # SSN OID
+            if root_oid == SSN_OID:
                 ssn = ext
             elif ext:
                 mrn = ext
 
-        # Name
-        name = ""
+        name = dob = gender = race = ethnicity = ""
         if patient is not None:
-            name_elem = _find(patient, "name", ns)
+            name_elem, birth, gender_elem, race_elem, eth_elem = _first_children(
+                patient, ("name", "birthTime", "administrativeGenderCode",
+                          "raceCode", "ethnicGroupCode"), ns)
+
+            # Name
             name = _parse_name(name_elem, ns)
 
-        # DOB
-        dob = ""
-        if patient is not None:
-            birth = _find(patient, "birthTime", ns)
+            # DOB
             if birth is not None:
                 dob = birth.get("value", "")
 
-        # Gender
-        gender = ""
-        if patient is not None:
-            gender_elem = _find(patient, "administrativeGenderCode", ns)
+            # Gender
             if gender_elem is not None:
                 gender = gender_elem.get("displayName", gender_elem.get("code", ""))
 
-        # Address
-        addr_elem = _find(patient_role, "addr", ns)
-        address = _parse_addr(addr_elem, ns)
-
-        # Telecom
-        telecom_elems = _findall(patient_role, "telecom", ns)
-        telecom = _parse_telecom(telecom_elems)
-
-        # Race/Ethnicity
-        race = ethnicity = ""
-        if patient is not None:
-            race_elem = _find(patient, "raceCode", ns)
+            # Race/Ethnicity
             if race_elem is not None:
                 race = race_elem.get("displayName", race_elem.get("code", ""))
-            eth_elem = _find(patient, "ethnicGroupCode", ns)
             if eth_elem is not None:
                 ethnicity = eth_elem.get("displayName", eth_elem.get("code", ""))
 
+        # Address
+        address = _parse_addr(addr, ns)
+
+        # Telecom
+        telecom = _parse_telecom(_children(patient_role, "telecom", ns))
+
         rows.append([name, dob, gender, address, telecom, mrn, ssn, race, ethnicity])
 
     if not rows:
@@ -277,7 +610,7 @@ def _parse_patient(root, ns):
 
 def _parse_authors(root, ns):
     """Extract author information."""
-    authors = _findall(root, "author", ns)
+    authors = _children(root, "author", ns)
     if not authors:
         return None
 
@@ -285,22 +618,22 @@ def _parse_authors(root, ns):
     rows = []
 
     for author in authors:
-        time_elem = _find(author, "time", ns)
+        time_elem = _child(author, "time", ns)
         time_val = time_elem.get("value", "") if time_elem is not None else ""
 
-        assigned = _find(author, "assignedAuthor", ns)
+        assigned = _child(author, "assignedAuthor", ns)
         name = ""
         org = ""
         if assigned is not None:
-            person = _find(assigned, "assignedPerson", ns)
+            person = _child(assigned, "assignedPerson", ns)
             if person is not None:
-                name_elem = _find(person, "name", ns)
+                name_elem = _child(person, "name", ns)
                 name = _parse_name(name_elem, ns)
 
-            org_elem = _find(assigned, "representedOrganization", ns)
+            org_elem = _child(assigned, "representedOrganization", ns)
             if org_elem is not None:
-                org_name = _find(org_elem, "name", ns)
-                org = _get_text(org_name) if org_name is not None else ""
+                org_name = _child(org_elem, "name", ns)
+                org = _get_leaf_text(org_name) if org_name is not None else ""
 
         rows.append([name, time_val, org])
 
@@ -309,160 +642,198 @@ def _parse_authors(root, ns):
     return {"name": "CDA Authors", "headers": headers, "rows": rows, "currency_cols": []}
 
 
-def _parse_sections(root, ns):
-    """Extract document sections (title + narrative text)."""
-    # Find structuredBody
-    body = _find(root, ".//structuredBody", ns)
-    if body is None:
-        body = root  # Try root directly
+def _parse_body(root, ns):
+    """Extract the sections sheet and the per-section entry sheets.
+
+    Both come from one walk over the body's components, which are located
+    once for the two of them.
 
-    components = _findall(body, "component", ns)
-    if not components:
-        # Try deeper nesting
+    Returns:
+        (sections sheet or None, list of entry sheets)
+    """
+    # Find structuredBody; without one, sections are still looked for
+    # under the root directly, but entries are not read
+    body = _find_structured_body(root, ns)
+    with_entries = body is not None
+
+    components = _children(body if with_entries else root, "component", ns)
+    if not components and with_entries:
+        # Try deeper nesting.  Without a structuredBody anywhere in the
+        # tree this search cannot match, so it is skipped
         components = _findall(root, ".//component/structuredBody/component", ns)
 
-    headers = ["Section Title", "Section Code", "Narrative Text (Preview)"]
     rows = []
-
+    entry_sheets = []
     for comp in components:
-        section = _find(comp, "section", ns)
-        if section is None:
-            continue
+        row, sheet = _parse_component(comp, ns, with_entries)
+        if row:
+            rows.append(row)
+        if sheet:
+            entry_sheets.append(sheet)
+
+    return _sections_sheet(rows), entry_sheets
 
-        title_elem = _find(section, "title", ns)
-        title = _get_text(title_elem) if title_elem is not None else ""
 
-        code_elem = _find(section, "code", ns)
-        code_val = ""
-        if code_elem is not None:
-            c = code_elem.get("code", "")
-            d = code_elem.get("displayName", "")
-            code_val = f"{c} — {d}" if d else c
+def _find_structured_body(root, ns):
+    """Find the structuredBody, normally at ClinicalDocument/component."""
+    # Going straight to the usual place avoids a search of the whole tree
+    comp = _child(root, "component", ns)
+    if comp is not None:
+        body = _child(comp, "structuredBody", ns)
+        if body is not None:
+            return body
+    return _find(root, ".//structuredBody", ns)
 
-        text_elem = _find(section, "text", ns)
-        narrative = ""
-        if text_elem is not None:
-            narrative = _get_text(text_elem)
-            # Truncate long narratives for the preview
-            if len(narrative) > 500:
-                narrative = narrative[:500] + "..."
 
-        if title or code_val:
-            rows.append([title, code_val, narrative])
+def _parse_component(comp, ns, with_entries=True):
+    """Parse the section in a body component.
 
+    Returns:
+        (sections sheet row or None, entries sheet or None)
+    """
+    section = _child(comp, "section", ns)
+    if section is None:
+        return None, None
+
+    title_elem = _child(section, "title", ns)
+    title = _get_leaf_text(title_elem) if title_elem is not None else ""
+
+    code_elem = _child(section, "code", ns)
+    code_val = ""
+    if code_elem is not None:
+        c = code_elem.get("code", "")
+        d = code_elem.get("displayName", "")
+        code_val = f"{c} — {d}" if d else c
+
+    text_elem = _child(section, "text", ns)
+    narrative = ""
+    if text_elem is not None:
+        # Truncate long narratives for the preview
+        narrative = _get_text_preview(text_elem, 500)
+
+    row = [title, code_val, narrative] if title or code_val else None
+
+    sheet = None
+    if with_entries:
+        section_title = title if title_elem is not None else "Unknown Section"
+        sheet = _parse_section_entries(section, section_title, ns)
+    return row, sheet
+
+
+def _sections_sheet(rows):
+    """The CDA Sections sheet, or None without rows."""
     if not rows:
         return None
+    headers = ["Section Title", "Section Code", "Narrative Text (Preview)"]
     return {"name": "CDA Sections", "headers": headers, "rows": rows, "currency_cols": []}
 
 
-def _parse_entries(root, ns):
-    """Extract structured entries from sections (medications, problems, etc.)."""
-    sheets = []
+def _parse_section_entries(section, section_title, ns):
+    """Extract a section's structured entries (medications, problems, etc.)."""
+    entries = _children(section, "entry", ns)
+    if not entries:
+        return None
 
-    body = _find(root, ".//structuredBody", ns)
-    if body is None:
-        return sheets
+    # Extract entry data generically
+    entry_rows = []
+    for entry in entries:
+        row_data = _extract_entry_data(entry, ns)
+        if row_data:
+            entry_rows.append(row_data)
 
-    components = _findall(body, "component", ns)
-    if not components:
-        components = _findall(root, ".//component/structuredBody/component", ns)
-
-    for comp in components:
-        section = _find(comp, "section", ns)
-        if section is None:
-            continue
+    if not entry_rows:
+        return None
 
-        title_elem = _find(section, "title", ns)
-        section_title = _get_text(title_elem) if title_elem is not None else "Unknown Section"
+    # Use consistent columns across all entries, in first-seen order (a
+    # dict keeps that order without scanning a list for every key)
+    headers = list(dict.fromkeys(k for row in entry_rows for k in row))
+    rows = [[row.get(k, "") for k in headers] for row in entry_rows]
 
-        entries = _findall(section, "entry", ns)
-        if not entries:
-            continue
+    sheet_name = f"CDA {section_title}"
+    if len(sheet_name) > 31:
+        sheet_name = sheet_name[:31]
+    return {"name": sheet_name, "headers": headers,
+            "rows": rows, "currency_cols": []}
 
-        # Extract entry data generically
-        entry_rows = []
-        for entry in entries:
-            row_data = _extract_entry_data(entry, ns)
-            if row_data:
-                entry_rows.append(row_data)
-
-        if entry_rows:
-            # Use consistent columns across all entries
-            all_keys = []
-            for row in entry_rows:
-                for k in row:
-                    if k not in all_keys:
-                        all_keys.append(k)
-
-            headers = all_keys
-            rows = [[row.get(k, "") for k in all_keys] for row in entry_rows]
-
-            sheet_name = f"CDA {section_title}"
-            if len(sheet_name) > 31:
-                sheet_name = sheet_name[:31]
-            sheets.append({"name": sheet_name, "headers": headers,
-                           "rows": rows, "currency_cols": []})
 
-    return sheets
+@lru_cache(maxsize=16)
+def _act_ranks(ns):
+    """Tag -> lookup priority of each act element, for one document namespace."""
+    # An act type is looked for with the namespace first, then without it
+    ranks = {}
+    for i, act_type in enumerate(ACT_TYPES):
+        if ns:
+            ranks[f"{ns}{act_type}"] = 2 * i
+        ranks[act_type] = 2 * i + 1
+    return ranks
 
 
 def _extract_entry_data(entry, ns):
     """Extract key data from a CDA entry element."""
+    # Look for common clinical act patterns. One pass over the entry's
+    # children (usually just the one act) replaces a find() per act type;
+    # when an entry holds several acts, the earliest type in ACT_TYPES wins.
+    ranks = _act_ranks(ns)
+    act = None
+    best = None
+    for child in entry:
+        rank = ranks.get(child.tag)
+        if rank is not None and (best is None or rank < best):
+            act = child
+            best = rank
+    if act is None:
+        return None
+
     data = {}
 
-    # Look for common clinical act patterns
-    for act_type in ["act", "observation", "substanceAdministration",
-                     "procedure", "encounter", "organizer", "supply"]:
-        act = _find(entry, act_type, ns)
-        if act is not None:
-            # Code
-            code_elem = _find(act, "code", ns)
-            if code_elem is not None:
-                data["Code"] = code_elem.get("code", "")
-                data["Display Name"] = code_elem.get("displayName", "")
-                data["Code System"] = code_elem.get("codeSystemName", "")
-
-            # Status
-            status = _find(act, "statusCode", ns)
-            if status is not None:
-                data["Status"] = status.get("code", "")
-
-            # Effective time
-            eff_time = _find(act, "effectiveTime", ns)
-            if eff_time is not None:
-                val = eff_time.get("value", "")
-                low = _find(eff_time, "low", ns)
-                high = _find(eff_time, "high", ns)
-                if val:
-                    data["Date"] = val
-                if low is not None:
-                    data["Start Date"] = low.get("value", "")
-                if high is not None:
-                    data["End Date"] = high.get("value", "")
-
-            # Value (for observations)
-            value_elem = _find(act, "value", ns)
-            if value_elem is not None:
-                val = value_elem.get("value", "")
-                unit = value_elem.get("unit", "")
-                display = value_elem.get("displayName", "")
-                code_val = value_elem.get("code", "")
-                if val and unit:
-                    data["Value"] = f"{val} {unit}"
-                elif display:
-                    data["Value"] = display
-                elif code_val:
-                    data["Value"] = code_val
-                elif val:
-                    data["Value"] = val
-
-            # Text
-            text_elem = _find(act, "text", ns)
-            if text_elem is not None:
-                text = _get_text(text_elem)
-                if text and len(text) < 200:
-                    data["Text"] = text
-
-            break  # Only process first matching act type
+    # Code
+    code_elem = _child(act, "code", ns)
+    if code_elem is not None:
+        data["Code"] = code_elem.get("code", "")
+        data["Display Name"] = code_elem.get("displayName", "")
+        data["Code System"] = code_elem.get("codeSystemName", "")
+
+    # Status
+    status = _child(act, "statusCode", ns)
+    if status is not None:
+        data["Status"] = status.get("code", "")
+
+    # Effective time
+    eff_time = _child(act, "effectiveTime", ns)
+    if eff_time is not None:
+        val = eff_time.get("value", "")
+        low = _child(eff_time, "low", ns)
+        high = _child(eff_time, "high", ns)
+        if val:
+            data["Date"] = val
+        if low is not None:
+            data["Start Date"] = low.get("value", "")
+        if high is not None:
+            data["End Date"] = high.get("value", "")
+
+    # Value (for observations)
+    value_elem = _child(act, "value", ns)
+    if value_elem is not None:
+        val = value_elem.get("value", "")
+        unit = value_elem.get("unit", "")
+        display = value_elem.get("displayName", "")
+        code_val = value_elem.get("code", "")
+        if val and unit:
+            data["Value"] = f"{val} {unit}"
+        elif display:
+            data["Value"] = display
+        elif code_val:
+            data["Value"] = code_val
+        elif val:
+            data["Value"] = val
+
+    # Text
+    text_elem = _child(act, "text", ns)
+    if text_elem is not None:
+        # Longer text comes back cut with "..." and is rejected
+        # below, so its full subtree is never read
+        text = _get_text_preview(text_elem, 200)
+        if text and len(text) < 200:
+            data["Text"] = text
 
     return data if data else None
@@ -2,6 +2,20 @@
 
 import json
 import re
+from collections import defaultdict
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # orjson is an optional speedup
+    _json_loads = json.loads
+
+# Namespace declarations stripped from FHIR XML that won't parse as-is:
+# double-quoted ones first, then a default namespace in either quote style
+_NS_ATTR_RE = re.compile(r'\s+xmlns[^"]*"[^"]*"')
+_NS_DEFAULT_RE = re.compile(r'\s+xmlns=["\'][^"\']*["\']')
+
+# Top-level fields left out of a generic resource's "Key Data" column
+_GENERIC_SKIP = frozenset(("resourceType", "id", "status", "meta", "text"))
 
 
 def parse_fhir(content):
@@ -20,7 +34,8 @@ def parse_fhir(content):
     resources = []
     if isinstance(data, dict):
         if data.get("resourceType") == "Bundle":
-            for entry in data.get("entry", []):
+            # A Bundle read from XML holds a lone entry as a dict, not a list
+            for entry in _ensure_list(data.get("entry", [])):
                 res = entry.get("resource", entry)
                 if isinstance(res, dict) and "resourceType" in res:
                     resources.append(res)
@@ -35,10 +50,9 @@ def parse_fhir(content):
         return []
 
     # Group by resource type
-    by_type = {}
+    by_type = defaultdict(list)
     for r in resources:
-        rt = r.get("resourceType", "Unknown")
-        by_type.setdefault(rt, []).append(r)
+        by_type[r.get("resourceType", "Unknown")].append(r)
 
     sheets = []
 
@@ -88,6 +102,13 @@ def _load_fhir(content):
 
     # JSON
     if content.startswith("{") or content.startswith("["):
+        try:
+            return _json_loads(content)
+        except ValueError:
+            if _json_loads is json.loads:
+                return None
+        # orjson rejects some input json accepts, such as NaN, integers
+        # over 64 bits and unpaired surrogate escapes
         try:
             return json.loads(content)
         except json.JSONDecodeError:
@@ -104,10 +125,15 @@ def _parse_fhir_xml(xml_content):
     """Minimal FHIR XML parser — extracts resourceType and basic fields."""
     try:
         import xml.etree.ElementTree as ET
-        # Strip FHIR namespace for easier parsing
-        cleaned = re.sub(r'\s+xmlns[^"]*"[^"]*"', '', xml_content)
-        cleaned = re.sub(r'\s+xmlns=["\'][^"\']*["\']', '', cleaned)
-        root = ET.fromstring(cleaned)
+        # Namespaces are dropped from the tags as the tree is walked, so the
+        # document is parsed as-is. Only one that won't parse that way gets
+        # its namespace declarations stripped and is parsed again.
+        try:
+            root = ET.fromstring(xml_content)
+        except ET.ParseError:
+            cleaned = _NS_ATTR_RE.sub('', xml_content)
+            cleaned = _NS_DEFAULT_RE.sub('', cleaned)
+            root = ET.fromstring(cleaned)
 
         def elem_to_dict(elem):
             d = {}
@@ -115,7 +141,7 @@ def _parse_fhir_xml(xml_content):
             if "value" in elem.attrib:
                 return elem.attrib["value"]
             for child in elem:
-                tag = child.tag.split("}")[-1]  # Remove namespace
+                tag = _local_name(child.tag)
                 val = elem_to_dict(child)
                 if tag in d:
                     if not isinstance(d[tag], list):
@@ -132,12 +158,17 @@ def _parse_fhir_xml(xml_content):
 
         result = elem_to_dict(root)
         if isinstance(result, dict):
-            result["resourceType"] = root.tag.split("}")[-1]
+            result["resourceType"] = _local_name(root.tag)
         return result
     except Exception:
         return None
 
 
+def _local_name(tag):
+    """Tag name without its {namespace} prefix."""
+    return tag[tag.rfind("}") + 1:]
+
+
 # ---------------------------------------------------------------------------
 # Helper extractors
 # ---------------------------------------------------------------------------
@@ -221,7 +252,7 @@ def _get_address(resource, path="address"):
     if isinstance(lines, str):
         lines = [lines]
     parts = lines + [addr.get("city", ""), addr.get("state", ""), addr.get("postalCode", "")]
-    return ", ".join(p for p in parts if p)
+    return ", ".join([p for p in parts if p])
 
 
 def _get_telecom(resource, system_filter=None):
@@ -280,25 +311,25 @@ def _parse_encounters(items):
             enc_class = enc_class.get("display", "") or enc_class.get("code", "")
 
         types = _ensure_list(r.get("type", []))
-        type_str = "; ".join(_get_coding(t) for t in types)
+        type_str = "; ".join([_get_coding(t) for t in types])
 
         start, end = _get_period(r.get("period"))
 
         reasons = _ensure_list(r.get("reasonCode", []))
-        reason_str = "; ".join(_get_coding(rc) for rc in reasons)
+        reason_str = "; ".join([_get_coding(rc) for rc in reasons])
 
         participants = _ensure_list(r.get("participant", []))
-        part_str = "; ".join(_get_reference_display(p.get("individual")) for p in participants)
+        part_str = "; ".join([_get_reference_display(p.get("individual")) for p in participants])
 
         locations = _ensure_list(r.get("location", []))
-        loc_str = "; ".join(_get_reference_display(l.get("location")) for l in locations)
+        loc_str = "; ".join([_get_reference_display(l.get("location")) for l in locations])
 
         dx_list = _ensure_list(r.get("diagnosis", []))
-        dx_str = "; ".join(_get_coding(d.get("condition") if isinstance(d.get("condition"), dict)
-                           and "coding" in d.get("condition", {}) else d.get("condition"))
-                           for d in dx_list)
+        dx_str = "; ".join([_get_coding(d.get("condition") if isinstance(d.get("condition"), dict)
+                            and "coding" in d.get("condition", {}) else d.get("condition"))
+                            for d in dx_list])
         if not dx_str:
-            dx_str = "; ".join(_get_reference_display(d.get("condition")) for d in dx_list)
+            dx_str = "; ".join([_get_reference_display(d.get("condition")) for d in dx_list])
 
         rows.append([
             _get_id(r), r.get("status", ""), enc_class, type_str,
@@ -316,7 +347,7 @@ def _parse_observations(items):
     rows = []
     for r in items:
         categories = _ensure_list(r.get("category", []))
-        cat_str = "; ".join(_get_coding(c) for c in categories)
+        cat_str = "; ".join([_get_coding(c) for c in categories])
 
         code, display = _get_coding(r.get("code"), join=False)
 
@@ -398,10 +429,10 @@ def _parse_procedures(items):
             perf_start = perf
 
         performers = _ensure_list(r.get("performer", []))
-        perf_str = "; ".join(_get_reference_display(p.get("actor")) for p in performers)
+        perf_str = "; ".join([_get_reference_display(p.get("actor")) for p in performers])
 
         reasons = _ensure_list(r.get("reasonCode", []))
-        reason_str = "; ".join(_get_coding(rc) for rc in reasons)
+        reason_str = "; ".join([_get_coding(rc) for rc in reasons])
 
         rows.append([
             _get_id(r), r.get("status", ""), code, display,
@@ -422,10 +453,10 @@ def _parse_medication_requests(items):
               _get_reference_display(r.get("medicationReference"))
 
         dosages = _ensure_list(r.get("dosageInstruction", []))
-        dosage_str = "; ".join(d.get("text", "") for d in dosages if d.get("text"))
+        dosage_str = "; ".join([d.get("text", "") for d in dosages if d.get("text")])
 
         reasons = _ensure_list(r.get("reasonCode", []))
-        reason_str = "; ".join(_get_coding(rc) for rc in reasons)
+        reason_str = "; ".join([_get_coding(rc) for rc in reasons])
 
         disp_req = r.get("dispenseRequest", {})
         disp_qty = ""
@@ -457,7 +488,7 @@ def _parse_medication_dispenses(items):
         ds_str = f"{ds.get('value', '')} {ds.get('unit', 'days')}".strip() if ds else ""
 
         performers = _ensure_list(r.get("performer", []))
-        perf_str = "; ".join(_get_reference_display(p.get("actor")) for p in performers)
+        perf_str = "; ".join([_get_reference_display(p.get("actor")) for p in performers])
 
         rows.append([
             _get_id(r), r.get("status", ""), med,
@@ -478,8 +509,8 @@ def _parse_claims(items):
         total_str = total.get("value", "") if isinstance(total, dict) else total
 
         dx_list = _ensure_list(r.get("diagnosis", []))
-        dx_str = "; ".join(_get_coding(d.get("diagnosisCodeableConcept"))
-                           for d in dx_list if d.get("diagnosisCodeableConcept"))
+        dx_str = "; ".join([_get_coding(d.get("diagnosisCodeableConcept"))
+                            for d in dx_list if d.get("diagnosisCodeableConcept")])
 
         items_list = _ensure_list(r.get("item", []))
 
@@ -524,8 +555,8 @@ def _parse_eobs(items):
             pay_date = payment.get("date", "")
 
         dx_list = _ensure_list(r.get("diagnosis", []))
-        dx_str = "; ".join(_get_coding(d.get("diagnosisCodeableConcept"))
-                           for d in dx_list if d.get("diagnosisCodeableConcept"))
+        dx_str = "; ".join([_get_coding(d.get("diagnosisCodeableConcept"))
+                            for d in dx_list if d.get("diagnosisCodeableConcept")])
 
         items_list = _ensure_list(r.get("item", []))
 
@@ -559,7 +590,7 @@ def _parse_coverages(items):
                 plan = cls.get("value", "") or cls.get("name", "")
 
         payors = _ensure_list(r.get("payor", []))
-        payor_str = "; ".join(_get_reference_display(p) for p in payors)
+        payor_str = "; ".join([_get_reference_display(p) for p in payors])
 
         start, end = _get_period(r.get("period"))
 
@@ -580,7 +611,7 @@ def _parse_diagnostic_reports(items):
     rows = []
     for r in items:
         categories = _ensure_list(r.get("category", []))
-        cat_str = "; ".join(_get_coding(c) for c in categories)
+        cat_str = "; ".join([_get_coding(c) for c in categories])
         code, display = _get_coding(r.get("code"), join=False)
         effective = r.get("effectiveDateTime", "")
         if not effective:
@@ -588,7 +619,7 @@ def _parse_diagnostic_reports(items):
             effective = ep.get("start", "") if ep else ""
 
         performers = _ensure_list(r.get("performer", []))
-        perf_str = "; ".join(_get_reference_display(p) for p in performers)
+        perf_str = "; ".join([_get_reference_display(p) for p in performers])
 
         results = _ensure_list(r.get("result", []))
 
@@ -615,7 +646,7 @@ def _parse_allergies(items):
         reaction_strs = []
         for rx in reactions:
             manifestations = _ensure_list(rx.get("manifestation", []))
-            m_str = "; ".join(_get_coding(m) for m in manifestations)
+            m_str = "; ".join([_get_coding(m) for m in manifestations])
             severity = rx.get("severity", "")
             if m_str:
                 reaction_strs.append(f"{m_str} ({severity})" if severity else m_str)
@@ -647,7 +678,7 @@ def _parse_immunizations(items):
         dose_str = f"{dose.get('value', '')} {dose.get('unit', '')}".strip() if dose else ""
 
         performers = _ensure_list(r.get("performer", []))
-        perf_str = "; ".join(_get_reference_display(p.get("actor")) for p in performers)
+        perf_str = "; ".join([_get_reference_display(p.get("actor")) for p in performers])
 
         rows.append([
             _get_id(r), r.get("status", ""), code, display,
@@ -665,11 +696,11 @@ def _parse_practitioners(items):
     rows = []
     for r in items:
         idents = _ensure_list(r.get("identifier", []))
-        ident_str = "; ".join(f"{i.get('value', '')} ({_get_coding(i.get('type'))})"
-                              for i in idents if i.get("value"))
+        ident_str = "; ".join([f"{i.get('value', '')} ({_get_coding(i.get('type'))})"
+                               for i in idents if i.get("value")])
 
         quals = _ensure_list(r.get("qualification", []))
-        qual_str = "; ".join(_get_coding(q.get("code")) for q in quals)
+        qual_str = "; ".join([_get_coding(q.get("code")) for q in quals])
 
         rows.append([
             _get_id(r), _get_name(r), r.get("gender", ""), r.get("birthDate", ""),
@@ -686,11 +717,11 @@ def _parse_organizations(items):
     rows = []
     for r in items:
         types = _ensure_list(r.get("type", []))
-        type_str = "; ".join(_get_coding(t) for t in types)
+        type_str = "; ".join([_get_coding(t) for t in types])
 
         idents = _ensure_list(r.get("identifier", []))
-        ident_str = "; ".join(f"{i.get('value', '')} ({_get_coding(i.get('type'))})"
-                              for i in idents if i.get("value"))
+        ident_str = "; ".join([f"{i.get('value', '')} ({_get_coding(i.get('type'))})"
+                               for i in idents if i.get("value")])
 
         rows.append([
             _get_id(r), r.get("name", ""), type_str, ident_str,
@@ -712,7 +743,7 @@ def _parse_generic(resource_type, items):
         # Collect a few meaningful top-level string fields
         key_data = []
         for k, v in r.items():
-            if k in ("resourceType", "id", "status", "meta", "text"):
+            if k in _GENERIC_SKIP:
                 continue
             if isinstance(v, str) and v and len(v) < 100:
                 key_data.append(f"{k}: {v}")
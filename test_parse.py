@@ -1,12 +1,19 @@
 """Quick smoke test for the parsers."""
 
+import importlib.util
+import io
 import os
 import sys
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
 
 from edi_parser import EDIFile
 from parser_835 import parse_835
 from parser_837 import parse_837
 from excel_writer import write_combined_excel
+from format_detect import detect_format
 
 # Sample 835 content
 SAMPLE_835 = (
@@ -93,6 +100,99 @@ SAMPLE_837 = (
     "IEA*1*000000002~"
 )
 
+# Sample CCD (CDA) document
+SAMPLE_CDA = """<?xml version="1.0" encoding="UTF-8"?>
+<ClinicalDocument xmlns="urn:hl7-org:v3" xmlns:sdtc="urn:hl7-org:sdtc">
+  <templateId root="2.16.840.1.113883.10.20.22.1.2"/>
+  <id root="1.2.3.4" extension="DOC001"/>
+  <code code="34133-9" codeSystem="2.16.840.1.113883.6.1" displayName="Summarization of Episode Note"/>
+  <title>Continuity of Care Document</title>
+  <effectiveTime value="20230115120000"/>
+  <recordTarget>
+    <patientRole>
+      <id root="2.16.840.1.113883.4.1" extension="123-45-6789"/>
+      <id root="1.2.3.4.5" extension="MRN001"/>
+      <addr use="HP">
+        <streetAddressLine>1 Main St</streetAddressLine>
+        <city>Springfield</city><state>IL</state><postalCode>62701</postalCode>
+      </addr>
+      <telecom use="HP" value="tel:+1-555-555-0100"/>
+      <patient>
+        <name use="L"><given>John</given><family>Doe</family></name>
+        <administrativeGenderCode code="M" displayName="Male"/>
+        <birthTime value="19800101"/>
+      </patient>
+    </patientRole>
+  </recordTarget>
+  <author>
+    <time value="20230115"/>
+    <assignedAuthor>
+      <id root="2.16.840.1.113883.4.6" extension="1234567890"/>
+      <assignedPerson><name><given>James</given><family>Smith</family></name></assignedPerson>
+      <representedOrganization><name>Smith Medical Group</name></representedOrganization>
+    </assignedAuthor>
+  </author>
+  <component>
+    <structuredBody>
+      <component>
+        <section>
+          <code code="11450-4" codeSystem="2.16.840.1.113883.6.1" displayName="Problem List"/>
+          <title>Problems</title>
+          <text>Essential hypertension</text>
+          <entry>
+            <act classCode="ACT" moodCode="EVN">
+              <code code="CONC"/>
+              <statusCode code="active"/>
+              <entryRelationship typeCode="SUBJ">
+                <observation classCode="OBS" moodCode="EVN">
+                  <code code="55607006" displayName="Problem"/>
+                  <effectiveTime><low value="20200301"/></effectiveTime>
+                  <value code="I10" codeSystem="2.16.840.1.113883.6.90" displayName="Essential hypertension"/>
+                </observation>
+              </entryRelationship>
+            </act>
+          </entry>
+        </section>
+      </component>
+      <component>
+        <section>
+          <code code="10160-0" codeSystem="2.16.840.1.113883.6.1" displayName="Medications"/>
+          <title>Medications</title>
+          <text>Lisinopril 10 mg daily</text>
+          <entry>
+            <substanceAdministration classCode="SBADM" moodCode="EVN">
+              <statusCode code="active"/>
+              <effectiveTime><low value="20200301"/></effectiveTime>
+              <doseQuantity value="10" unit="mg"/>
+              <consumable>
+                <manufacturedProduct>
+                  <manufacturedMaterial>
+                    <code code="314076" codeSystem="2.16.840.1.113883.6.88" displayName="Lisinopril 10 MG Oral Tablet"/>
+                  </manufacturedMaterial>
+                </manufacturedProduct>
+              </consumable>
+            </substanceAdministration>
+          </entry>
+        </section>
+      </component>
+      <component>
+        <section>
+          <code code="30954-2" codeSystem="2.16.840.1.113883.6.1" displayName="Results"/>
+          <title>Results</title>
+          <entry>
+            <observation classCode="OBS" moodCode="EVN">
+              <code code="2345-7" displayName="Glucose"/>
+              <effectiveTime value="20230110"/>
+              <value value="95" unit="mg/dL"/>
+            </observation>
+          </entry>
+        </section>
+      </component>
+    </structuredBody>
+  </component>
+</ClinicalDocument>
+"""
+
 
 def test_835():
     print("=" * 50)
@@ -136,6 +236,37 @@ def test_835():
     print(f"File size: {os.path.getsize(output):,} bytes")
 
 
+def test_835_claim_and_service_dates():
+    claims = parse_835(EDIFile(SAMPLE_835))[0]["claims"]
+    # DTM*232/233 under CLP and DTM*472 under SVC
+    assert [(c["claim_statement_from"], c["claim_statement_to"]) for c in claims] == [
+        ("12/15/2022", "12/15/2022"),
+        ("12/20/2022", "12/20/2022"),
+    ]
+    assert [[svc["service_date"] for svc in c["service_lines"]] for c in claims] == [
+        ["12/15/2022", "12/15/2022"],
+        ["12/20/2022", "12/20/2022"],
+    ]
+
+
+def test_835_svc_modifiers_skip_empty_positions():
+    content = SAMPLE_835.replace("SVC*HC:99213*", "SVC*HC:99213:::59*")
+    claims = parse_835(EDIFile(content))[0]["claims"]
+    svc = claims[0]["service_lines"][0]
+    assert svc["procedure_code"] == "99213"
+    assert svc["modifiers"] == "59"
+    # No modifiers at all still gives an empty string
+    assert claims[0]["service_lines"][1]["modifiers"] == ""
+
+
+def test_transaction_type_without_st01():
+    assert EDIFile(SAMPLE_835).get_transaction_type() == "835"
+    # An empty ST01 is reported as "", a missing one (or no ST) as None
+    assert EDIFile(SAMPLE_835.replace("ST*835*0001~", "ST**0001~")).get_transaction_type() == ""
+    assert EDIFile(SAMPLE_835.replace("ST*835*0001~", "ST~")).get_transaction_type() is None
+    assert EDIFile(SAMPLE_835.replace("ST*835*0001~", "")).get_transaction_type() is None
+
+
 def test_837():
     print("\n" + "=" * 50)
     print("Testing 837 Parser")
@@ -169,6 +300,223 @@ def test_837():
     print(f"File size: {os.path.getsize(output):,} bytes")
 
 
+def test_upload_after_pool_breaks():
+    import app as web
+
+    # A worker that dies (e.g. killed for memory) breaks the whole pool
+    try:
+        web._POOL.submit(os._exit, 1).result()
+    except BrokenProcessPool:
+        pass
+
+    client = web.app.test_client()
+    for _ in range(2):
+        response = client.post("/upload", data={"files": [
+            (io.BytesIO(SAMPLE_835.encode()), "a.835"),
+            (io.BytesIO(SAMPLE_837.encode()), "b.837"),
+        ]}, content_type="multipart/form-data")
+        assert response.status_code == 200, response.data
+
+
+class _StubPool:
+    """Runs submissions inline; a broken one fails every Future it returns."""
+
+    def __init__(self, broken, replace_with=None):
+        self.broken = broken
+        self.replace_with = replace_with
+        self.is_shut_down = False
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool("worker died"))
+        else:
+            future.set_result(fn(*args))
+        if self.replace_with is not None:
+            # Another request notices the breakage and swaps in a new pool
+            import app as web
+            web._POOL = self.replace_with
+        return future
+
+    def shutdown(self, wait=True):
+        self.is_shut_down = True
+
+
+def test_upload_keeps_pool_replaced_by_another_request(monkeypatch):
+    import app as web
+
+    healthy = _StubPool(broken=False)
+    broken = _StubPool(broken=True, replace_with=healthy)
+    monkeypatch.setattr(web, "_POOL", broken)
+
+    response = web.app.test_client().post("/upload", data={"files": [
+        (io.BytesIO(SAMPLE_835.encode()), "a.835"),
+        (io.BytesIO(SAMPLE_837.encode()), "b.837"),
+    ]}, content_type="multipart/form-data")
+    assert response.status_code == 200, response.data
+    # Only the pool the failed Future came from is shut down and replaced
+    assert web._POOL is healthy
+    assert not healthy.is_shut_down
+    assert broken.is_shut_down
+
+
+def _load_parser_cda(block_lxml):
+    """Import a fresh copy of parser_cda, optionally with lxml hidden."""
+    hidden = {}
+    if block_lxml:
+        hidden = {name: sys.modules.get(name) for name in ("lxml", "lxml.etree")}
+        # A None entry makes "from lxml import etree" raise ImportError
+        sys.modules.update(dict.fromkeys(hidden))
+    try:
+        spec = importlib.util.find_spec("parser_cda")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for name, saved in hidden.items():
+            if saved is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = saved
+    return module
+
+
+def _check_cda_stream(parser_cda):
+    expected = parser_cda.parse_cda(SAMPLE_CDA.encode())
+    assert [sheet["name"] for sheet in expected] == [
+        "CDA Document Info", "CDA Patient", "CDA Authors", "CDA Sections",
+        "CDA Problems", "CDA Medications", "CDA Results",
+    ]
+    assert parser_cda.parse_cda_stream(io.BytesIO(SAMPLE_CDA.encode())) == expected
+
+
+def test_cda_stream_elementtree():
+    parser_cda = _load_parser_cda(block_lxml=True)
+    assert not parser_cda.HAVE_LXML
+    _check_cda_stream(parser_cda)
+
+
+def test_cda_stream_lxml():
+    pytest.importorskip("lxml.etree")
+    parser_cda = _load_parser_cda(block_lxml=False)
+    assert parser_cda.HAVE_LXML
+    _check_cda_stream(parser_cda)
+
+
+def _check_cda_entities_not_resolved(parser_cda, tmp_path):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("TOP-SECRET")
+    doc = (
+        f'<?xml version="1.0"?><!DOCTYPE ClinicalDocument '
+        f'[<!ENTITY leak SYSTEM "{secret.as_uri()}">]>'
+        '<ClinicalDocument xmlns="urn:hl7-org:v3"><title>Leak &leak;</title>'
+        '<recordTarget><patientRole><patient><name><family>&leak;</family>'
+        '</name></patient></patientRole></recordTarget></ClinicalDocument>'
+    )
+    # Well-formed, then truncated so only the recovering parser takes it
+    for content in (doc, doc[:-len("</ClinicalDocument>")]):
+        sheets = parser_cda.parse_cda(content.encode())
+        assert "TOP-SECRET" not in repr(sheets)
+        stream_sheets = parser_cda.parse_cda_stream(io.BytesIO(content.encode()))
+        assert "TOP-SECRET" not in repr(stream_sheets)
+
+
+def test_cda_entities_not_resolved_elementtree(tmp_path):
+    parser_cda = _load_parser_cda(block_lxml=True)
+    _check_cda_entities_not_resolved(parser_cda, tmp_path)
+
+
+def test_cda_entities_not_resolved_lxml(tmp_path):
+    pytest.importorskip("lxml.etree")
+    parser_cda = _load_parser_cda(block_lxml=False)
+    # The truncated document must get through the recovering parser
+    assert parser_cda.parse_cda(b'<ClinicalDocument xmlns="urn:hl7-org:v3">'
+                                b'<title>Partial</title>')
+    _check_cda_entities_not_resolved(parser_cda, tmp_path)
+
+
+def test_cda_ssn_needs_exact_oid():
+    from parser_cda import parse_cda
+
+    def patient_ids(content):
+        sheet = next(s for s in parse_cda(content) if s["name"] == "CDA Patient")
+        row = dict(zip(sheet["headers"], sheet["rows"][0]))
+        return row["MRN"], row["SSN"]
+
+    assert patient_ids(SAMPLE_CDA) == ("MRN001", "123-45-6789")
+    # An OID that merely starts with the SSN OID is some other identifier
+    other_oid = SAMPLE_CDA.replace('root="2.16.840.1.113883.4.1"',
+                                   'root="2.16.840.1.113883.4.1.1"')
+    assert other_oid != SAMPLE_CDA
+    assert patient_ids(other_oid) == ("MRN001", "")
+
+
+def test_cda_bytes_retry_without_xmlns():
+    # ElementTree has no recovering parser, so only the retry with the
+    # namespace declarations stripped can read this document
+    parser_cda = _load_parser_cda(block_lxml=True)
+    doc = SAMPLE_CDA.replace(
+        '<ClinicalDocument xmlns="urn:hl7-org:v3"',
+        '<ClinicalDocument xmlns="urn:hl7-org:v3" xmlns = \'urn:hl7-org:v3\'',
+    ).encode()
+    sheets = parser_cda.parse_cda(doc)
+    assert sheets[0]["name"] == "CDA Document Info"
+    assert sheets[0]["rows"][0] == ["Document Title", "Continuity of Care Document"]
+    assert parser_cda.parse_cda(doc.decode()) == sheets
+
+
+def test_cda_result_cache_bounds(monkeypatch):
+    import parser_cda
+
+    size = len(SAMPLE_CDA.encode())
+    monkeypatch.setattr(parser_cda, "_RESULT_CACHE", parser_cda.OrderedDict())
+    monkeypatch.setattr(parser_cda, "_result_cache_bytes", 0)
+    monkeypatch.setattr(parser_cda, "_RESULT_CACHE_MAX_DOC_SIZE", size + 10)
+    monkeypatch.setattr(parser_cda, "_RESULT_CACHE_MAX_BYTES", 2 * size + 20)
+
+    docs = [SAMPLE_CDA.replace("DOC001", f"DOC{i:03d}") for i in range(3)]
+    for doc in docs:
+        parser_cda.parse_cda(doc)
+    # Only the two newest fit in the byte budget
+    assert len(parser_cda._RESULT_CACHE) == 2
+    assert parser_cda._result_cache_bytes == 2 * size
+
+    # Documents over the per-document limit aren't cached at all
+    large = SAMPLE_CDA + " " * 20
+    sheets = parser_cda.parse_cda(large)
+    assert len(parser_cda._RESULT_CACHE) == 2
+    assert sheets == parser_cda.parse_cda(SAMPLE_CDA)
+
+
+def test_detect_wide_quoted_csv():
+    # Rows this wide run past any fixed-size head of the file
+    header = ",".join(f'"Column Name {i:03d}"' for i in range(300))
+    row = ",".join(f'"value {i}"' for i in range(300))
+    content = "\n".join([header] + [row] * 10)
+    assert detect_format(content) == "csv"
+
+    import app as web
+    response = web.app.test_client().post("/upload", data={
+        "files": [(io.BytesIO(content.encode()), "wide.csv")],
+    }, content_type="multipart/form-data")
+    assert response.status_code == 200, response.data
+
+
+def test_detect_fhir_json():
+    resource = '{"resourceType": "Patient", "id": "1"}'
+    assert detect_format(resource) == "fhir"
+    # Small documents are deserialized, so invalid JSON isn't taken as FHIR
+    assert detect_format('{"resourceType": "Patient", "id": "1",}') is None
+    assert detect_format('{"resourceType": "Patient", "id": "1"') is None
+
+    # Large ones are classified by their head alone; the FHIR parser then
+    # reports any syntax error
+    entries = ", ".join(['{"resource": %s}' % resource] * 40000)
+    bundle = '{"resourceType": "Bundle", "entry": [%s],}' % entries
+    assert len(bundle) > 1024 * 1024
+    assert detect_format(bundle) == "fhir"
+    assert detect_format(bundle[:-1]) is None
+
+
 if __name__ == "__main__":
     test_835()
     test_837()